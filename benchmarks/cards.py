@@ -0,0 +1,65 @@
+# Copyright (c) 2020 Slavfox
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+Compares reading amiibo cards from one file each, the way they used to be
+sent, against reading them from the memory-mapped card archive.
+
+Uses random cards in a temporary directory, so it runs without any dumps.
+
+Usage: poetry run python benchmarks/cards.py [repetitions]
+"""
+from __future__ import annotations
+
+import os
+import random
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+from rzepabot.cards import CardArchive, write
+from rzepabot.data import villagers
+
+CARD_SIZE = 540
+
+
+def read_file(directory, name):
+    path = directory / f"{name}.bin"
+    if path.is_file():
+        with open(path, "rb") as f:
+            return f.read()
+
+
+def read_archive(archive, name):
+    return archive.file(name).read()
+
+
+def measure(func, names):
+    start = perf_counter()
+    for name in names:
+        func(name)
+    return (perf_counter() - start) / len(names) * 1e6
+
+
+if __name__ == "__main__":
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    directory = Path(tempfile.mkdtemp())
+    cards = {row[0]: os.urandom(CARD_SIZE) for row in villagers}
+    for name, card in cards.items():
+        (directory / f"{name}.bin").write_bytes(card)
+    write(cards, str(directory / "cards.bin"))
+    archive = CardArchive.open(str(directory / "cards.bin"))
+    # Popular villagers get asked about much more often than the rest.
+    names = random.choices(
+        list(cards),
+        weights=[1 / (i + 1) for i in range(len(cards))],
+        k=repetitions * len(cards),
+    )
+    files = measure(lambda name: read_file(directory, name), names)
+    packed = measure(lambda name: read_archive(archive, name), names)
+    print(f"{len(cards)} cards, {len(names)} lookups")
+    print(f"one file per card: {files:8.2f} µs/card")
+    print(f"card archive:      {packed:8.2f} µs/card")
@@ -0,0 +1,88 @@
+# Copyright (c) 2020 Slavfox
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+Compares commands/s when every command opens and closes its own connection
+with default pragmas against a persistent, tuned connection.
+
+Every simulated command runs the queries of ``$profil``; every tenth one
+also updates a hot item.
+
+Usage: poetry run python benchmarks/connections.py [number of commands]
+"""
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+os.environ["RZEPABOT_DB"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+
+from peewee import SqliteDatabase  # noqa: E402
+
+from rzepabot.config import DB_PATH  # noqa: E402
+from rzepabot.migrations import migrate  # noqa: E402
+from rzepabot.persistence import (  # noqa: E402
+    DodoCode,
+    Guild,
+    HotItem,
+    Island,
+    User,
+    db,
+    models,
+    transaction,
+)
+
+USERS = 1000
+
+
+def command(i):
+    user = User.get(User.discord_id == i % USERS)
+    Island.get_or_none(Island.villager == user)
+    HotItem.select(HotItem.item).where(HotItem.user == user).first()
+    DodoCode.select(DodoCode.code).where(DodoCode.user == user).first()
+    if i % 10 == 0:
+        HotItem.delete().where(HotItem.user == user).execute()
+        HotItem.create(user=user, item=f"item {i}")
+
+
+def per_command_connection(n):
+    plain = SqliteDatabase(DB_PATH, pragmas={"foreign_keys": 1})
+    with plain.bind_ctx(models):
+        plain.execute_sql("PRAGMA journal_mode=delete")
+        plain.close()
+        for i in range(n):
+            with plain:
+                command(i)
+
+
+def persistent_connection(n):
+    db.close()
+    for i in range(n):
+        with transaction(db):
+            command(i)
+
+
+def measure(func, n):
+    start = perf_counter()
+    func(n)
+    return n / (perf_counter() - start)
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    migrate()
+    with db:
+        User.insert_many([{"discord_id": i} for i in range(USERS)]).execute()
+        Guild.create(discord_id=1)
+        Island.insert_many(
+            [{"villager": u.id} for u in User.select(User.id)]
+        ).execute()
+    before = measure(per_command_connection, n)
+    after = measure(persistent_connection, n)
+    print(f"{n} commands")
+    print(f"connection per command: {before:10.0f} commands/s")
+    print(f"persistent, tuned:      {after:10.0f} commands/s")
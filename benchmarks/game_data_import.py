@@ -0,0 +1,79 @@
+# Copyright (c) 2020 Slavfox
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+Compares loading game data by importing the Python literal modules, with
+and without cached bytecode, against loading the binary bundle.
+
+Every measurement runs in a fresh interpreter. Build the bundle first:
+
+    poetry run python -m rzepabot.data.bundle
+
+Usage: poetry run python benchmarks/game_data_import.py [runs]
+"""
+from __future__ import annotations
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+# The bot imports these anyway, so they're not counted.
+PRELUDE = """
+import pathlib, struct, typing
+from time import perf_counter
+"""
+
+SOURCES = PRELUDE + """
+start = perf_counter()
+from rzepabot.data.bugs import bugs
+from rzepabot.data.fish import fish
+from rzepabot.data.villagers import villagers
+print(perf_counter() - start)
+"""
+
+BUNDLE = PRELUDE + """
+start = perf_counter()
+from rzepabot.data import bundle
+villagers, fish, bugs = bundle.load()
+print(perf_counter() - start)
+"""
+
+
+def measure(code, runs, pycache):
+    env = dict(os.environ, PYTHONPATH=str(ROOT), PYTHONPYCACHEPREFIX=pycache)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    times = []
+    for _ in range(runs):
+        if pycache == "cold":
+            env["PYTHONPYCACHEPREFIX"] = tempfile.mkdtemp()
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        times.append(float(output) * 1000)
+    return statistics.median(times)
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    warm = tempfile.mkdtemp()
+    # Populate the bytecode cache.
+    measure(SOURCES, 1, warm)
+    measure(BUNDLE, 1, warm)
+    cold = measure(SOURCES, runs, "cold")
+    cached = measure(SOURCES, runs, warm)
+    bundled = measure(BUNDLE, runs, warm)
+    print(f"median of {runs} runs")
+    print(f"source modules, no bytecode: {cold:8.1f} ms")
+    print(f"source modules, cached:      {cached:8.1f} ms")
+    print(f"binary bundle:               {bundled:8.1f} ms")
@@ -0,0 +1,203 @@
+# Copyright (c) 2020 Slavfox
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+Runs every query the cogs issue against a scratch database, captures its
+``EXPLAIN QUERY PLAN`` and fails if any of them scans a whole table that
+grows with the number of users.
+
+Usage: poetry run python benchmarks/query_plans.py [-v]
+"""
+from __future__ import annotations
+
+import os
+import re
+import sys
+import tempfile
+from types import SimpleNamespace
+
+os.environ["RZEPABOT_DB"] = os.path.join(tempfile.mkdtemp(), "plans.db")
+
+from rzepabot import gamedata, persistence, stalks  # noqa: E402
+from rzepabot.migrations import migrate  # noqa: E402
+from rzepabot.persistence import (  # noqa: E402
+    DodoCode,
+    Guild,
+    HotItem,
+    Island,
+    StalkPrice,
+    User,
+    Villager,
+    db,
+    transaction,
+)
+from rzepabot.plugins import dodokod, profile  # noqa: E402
+
+GROWING_TABLES = {
+    "user",
+    "guild",
+    "guildmembership",
+    "island",
+    "stalkprice",
+    "residency",
+    "hotitem",
+    "dodocode",
+    "museumcritter",
+    "turnipforecast",
+}
+
+# (function, table) pairs which are allowed to scan, and why.
+ALLOWED_SCANS = {
+    ("prune_guilds", "guild"): "runs once per process, on the first on_ready",
+}
+
+ALIAS = re.compile(r'"(\w+)" AS "(\w+)"')
+SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)")
+
+
+def seed():
+    Villager.insert_many(
+        [
+            {
+                "name": name,
+                "birthday_month": 1,
+                "birthday_day": 1,
+                "personality": "Leniwy",
+                "species": "Goryl",
+                "image_url": "",
+            }
+            for name in ("Al", "Raymond", "Marshal")
+        ]
+    ).execute()
+    for i in range(1, 4):
+        user = User.create(discord_id=i)
+        guild = Guild.create(discord_id=i)
+        persistence.add_membership(user.id, guild.id)
+        Island.create(villager=user)
+        HotItem.create(user=user, item="Patelnia")
+        DodoCode.create(user=user, guild=guild, code="ABCDE")
+        StalkPrice.create(user=user, price=100)
+
+
+def workload():
+    """Yields (label, thunk) pairs exercising every query the cogs run."""
+    guild_obj = SimpleNamespace(id=1)
+    user = User.get(User.discord_id == 1)
+    guild = Guild.get(Guild.discord_id == 1)
+    gamedata.load()
+    villagers = profile.find_villagers(["raymond", "marshal"])
+    now = persistence.now_string()
+    yield "find_user_and_guild", lambda: persistence.find_user_and_guild(
+        1, 1
+    )
+    yield "create_user_and_guild", lambda: (
+        persistence.create_user_and_guild(4, 1)
+    )
+    yield "add_guild", lambda: persistence.add_guild(5)
+    yield "register_dodocode", lambda: dodokod.register_dodocode(
+        user, guild, "QWERT", None
+    )
+    yield "get_open_islands", lambda: dodokod.get_open_islands(guild)
+    yield "remove_dodocode", lambda: dodokod.remove_dodocode(user)
+    yield "update_island", lambda: profile.update_island(
+        user, island_name="Rzepowo"
+    )
+    yield "add_residents", lambda: profile.add_residents(
+        user, villagers, "@user"
+    )
+    yield "load_profile", lambda: profile.load_profile(user, guild)
+    yield "remove_residents", lambda: profile.remove_residents(
+        user, villagers[:1]
+    )
+    yield "set_hot_item", lambda: profile.set_hot_item(user, "Łopata")
+    yield "get_guild_hot_items", lambda: profile.get_guild_hot_items(guild)
+    yield "get_current_week_prices", lambda: list(
+        stalks.get_current_week_prices(user)[0]
+    )
+    yield "insert_stalk_price", lambda: stalks.insert_stalk_price(
+        user, 100, True, persistence.tznow_dt()
+    )
+    yield "find_forecast", lambda: stalks.find_forecast(
+        user, stalks.week_start()
+    )
+    yield "store_forecast", lambda: stalks.store_forecast(
+        *stalks.find_forecast(user, stalks.week_start())[:2]
+    )
+    yield "forecast_guild", lambda: stalks.forecast_guild(guild)
+    yield "gamedata.load", lambda: gamedata.load()
+    for model in persistence.EXPIRING_MODELS:
+        yield "delete_expired", lambda: persistence.delete_expired(
+            model, now, persistence.CHUNK_SIZE
+        )
+    yield "prune_guilds", lambda: persistence.prune_guilds(
+        [guild_obj.id, 2, 3]
+    )
+    yield "delete_guilds", lambda: persistence.delete_guilds([3])
+
+
+def capture():
+    """
+    Yields (label, [(sql, plan)]) for every step of the workload.
+
+    Plans are taken right before each statement runs, so that they see the
+    same schema (including temporary tables) as the statement itself.
+    """
+    captured = []
+    execute_sql = db.execute_sql
+
+    def explaining_execute_sql(sql, params=None, *args, **kwargs):
+        if sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            plan = [
+                row[3]
+                for row in execute_sql(f"EXPLAIN QUERY PLAN {sql}", params)
+            ]
+            captured.append((sql, plan))
+        return execute_sql(sql, params, *args, **kwargs)
+
+    db.execute_sql = explaining_execute_sql
+    try:
+        for label, thunk in workload():
+            del captured[:]
+            with transaction(db):
+                thunk()
+            yield label, list(captured)
+    finally:
+        db.execute_sql = execute_sql
+
+
+def main(verbose=False):
+    migrate()
+    persistence.attach_static(writable=True)
+    with transaction(db):
+        seed()
+    persistence.attach_static()
+    failures = []
+    for label, queries in capture():
+        for sql, plan in queries:
+            aliases = {alias: table for table, alias in ALIAS.findall(sql)}
+            if verbose:
+                print(f"{label}: {sql}")
+                for line in plan:
+                    print(f"    {line}")
+            for line in plan:
+                match = SCAN.match(line)
+                if not match:
+                    continue
+                table = aliases.get(match.group(1), match.group(1))
+                if (
+                    table in GROWING_TABLES
+                    and (label, table) not in ALLOWED_SCANS
+                ):
+                    failures.append((label, sql, line))
+    for label, sql, line in failures:
+        print(f"FAIL {label}: {line}\n    {sql}")
+    if failures:
+        return 1
+    print("No full table scans.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(verbose="-v" in sys.argv))
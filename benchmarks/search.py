@@ -0,0 +1,64 @@
+# Copyright (c) 2020 Slavfox
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+Compares villager search over the full villager list against scanning
+every name: substring queries through the trigram index, and "did you
+mean" suggestions through the deletion index.
+
+Usage: poetry run python benchmarks/search.py [repetitions]
+"""
+from __future__ import annotations
+
+import sys
+from time import perf_counter
+
+from rzepabot.data import villagers
+from rzepabot.gamedata import normalize_name
+from rzepabot.search import SearchIndex, max_typos, osa_distance
+
+SUBSTRING_QUERIES = ["ray", "marsh", "al", "bob", "ette", "kid c", "zzz"]
+TYPO_QUERIES = ["raymnod", "marhsal", "rosei", "fauan", "kid kat", "bbo"]
+
+
+def scan_substring(names, query):
+    return sorted(
+        (key.find(query), len(key), key) for key in names if query in key
+    )
+
+
+def scan_suggest(names, query):
+    return sorted(
+        (distance, key)
+        for key in names
+        if (distance := osa_distance(query, key)) <= max_typos(query)
+    )[:5]
+
+
+def measure(func, queries, repetitions):
+    start = perf_counter()
+    for _ in range(repetitions):
+        for query in queries:
+            func(query)
+    return (perf_counter() - start) / (repetitions * len(queries)) * 1e6
+
+
+if __name__ == "__main__":
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    names = [normalize_name(row[0]) for row in villagers]
+    start = perf_counter()
+    index = SearchIndex((name, name) for name in names)
+    build = (perf_counter() - start) * 1000
+    print(f"{len(names)} villagers, index built in {build:.1f} ms")
+    for label, indexed, scanned, queries in (
+        ("substring", index.substring, scan_substring, SUBSTRING_QUERIES),
+        ("suggest", index.suggest, scan_suggest, TYPO_QUERIES),
+    ):
+        before = measure(lambda q: scanned(names, q), queries, repetitions)
+        after = measure(indexed, queries, repetitions)
+        print(
+            f"{label:10} scan: {before:8.1f} µs/query   "
+            f"index: {after:8.1f} µs/query"
+        )
@@ -0,0 +1,134 @@
+# Copyright (c) 2020 Slavfox
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+Compares guessing the turnip price pattern with the vectorized scenario
+arrays against scoring the same scenarios one by one in plain Python, and
+updating a forecast with a new price against rebuilding it, and forecasting
+for a whole guild at once against forecasting for every member separately.
+
+Usage: poetry run python benchmarks/turnips.py [repetitions] [users]
+"""
+from __future__ import annotations
+
+import math
+import sys
+from time import perf_counter
+
+import numpy as np
+
+from rzepabot.stalks import (
+    BASE_PRICES,
+    SCENARIOS,
+    Forecast,
+    forecast_batch,
+    likelihoods,
+    pattern_prior,
+    scenario_templates,
+)
+
+# Monday to Wednesday of a small spike week, bought at 100.
+OBSERVED = [79, 75, 71, 68, 119, 134]
+BUY_PRICE = 100
+
+
+def naive_guess(observed, buy_price):
+    prior = pattern_prior()
+    scores = [0.0] * 4
+    for base in BASE_PRICES.tolist():
+        if buy_price is not None and base != buy_price:
+            continue
+        for pattern, weight, run in scenario_templates():
+            score = prior[pattern] * weight
+            for price, (low_rate, high_rate, offset) in zip(observed, run):
+                low = math.trunc(low_rate * base + 0.99999) + offset
+                high = math.trunc(high_rate * base + 0.99999) + offset
+                if not low <= price <= high:
+                    break
+                score /= high - low + 1
+            else:
+                scores[pattern] += score
+    total = sum(scores)
+    return [score / total for score in scores]
+
+
+def vectorized_guess(observed, buy_price):
+    scores = likelihoods(price_vector(observed), buy_price)
+    return np.bincount(SCENARIOS.pattern, scores, minlength=4) / scores.sum()
+
+
+def price_vector(observed):
+    vector = np.full(12, np.nan)
+    vector[: len(observed)] = observed
+    return vector
+
+
+def random_weeks(users, rng):
+    """Prices some random scenarios could produce, up to a random day."""
+    scenario = rng.integers(len(SCENARIOS.pattern), size=users)
+    low, high = SCENARIOS.low[scenario], SCENARIOS.high[scenario]
+    observed = rng.integers(low, high + 1).astype(float)
+    observed[np.arange(12) >= rng.integers(0, 9, size=(users, 1))] = np.nan
+    buy_prices = SCENARIOS.base_price[scenario].astype(float)
+    buy_prices[rng.random(users) < 0.2] = np.nan
+    return observed, buy_prices
+
+
+def measure(func, repetitions):
+    start = perf_counter()
+    for _ in range(repetitions):
+        result = func()
+    return (perf_counter() - start) / repetitions * 1000, result
+
+
+if __name__ == "__main__":
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    print(f"{len(SCENARIOS.pattern)} scenarios")
+    for label, buy_price in (("known", BUY_PRICE), ("unknown", None)):
+        naive, expected = measure(
+            lambda: naive_guess(OBSERVED, buy_price), repetitions
+        )
+        vectorized, result = measure(
+            lambda: vectorized_guess(OBSERVED, buy_price), repetitions
+        )
+        assert np.allclose(expected, result)
+        print(
+            f"buy price {label:7}  python: {naive:8.3f} ms   "
+            f"numpy: {vectorized:8.3f} ms"
+        )
+    # Entering Wednesday afternoon's price.
+    before = Forecast.from_vector(price_vector(OBSERVED[:-1]))
+    after = price_vector(OBSERVED)
+    rebuild, expected = measure(
+        lambda: Forecast.from_vector(after), repetitions
+    )
+    update, result = measure(
+        lambda: before.observe(len(OBSERVED) - 1, OBSERVED[-1]), repetitions
+    )
+    assert np.allclose(expected.patterns, result.patterns)
+    ranges, _ = measure(result.ranges, repetitions)
+    print(
+        f"new price      rebuild: {rebuild:8.3f} ms   "
+        f"update: {update:8.3f} ms   ranges: {ranges:8.3f} ms"
+    )
+    observed, buy_prices = random_weeks(users, np.random.default_rng(0))
+    one_by_one, _ = measure(
+        lambda: [
+            Forecast.from_vector(
+                vector, None if np.isnan(buy) else int(buy)
+            ).summary()
+            for vector, buy in zip(observed, buy_prices)
+        ],
+        max(1, repetitions // 50),
+    )
+    batch, _ = measure(
+        lambda: forecast_batch(observed, buy_prices),
+        max(1, repetitions // 10),
+    )
+    print(
+        f"{users} users    one by one: {one_by_one:8.1f} ms   "
+        f"batch: {batch:8.1f} ms"
+    )
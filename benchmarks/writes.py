@@ -0,0 +1,69 @@
+# Copyright (c) 2020 Slavfox
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+Measures write throughput under a burst of concurrent commands, with every
+write in its own transaction on the thread pool versus group-committed
+through the single writer.
+
+Usage: poetry run python benchmarks/writes.py [number of writes]
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+os.environ["RZEPABOT_DB"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+
+from rzepabot.migrations import migrate  # noqa: E402
+from rzepabot.persistence import (  # noqa: E402
+    HotItem,
+    User,
+    db,
+    db_pool,
+    db_writer,
+)
+
+
+# Saturating the pool is the point here, don't log every queued write.
+logging.getLogger("rzepabot").setLevel(logging.ERROR)
+
+
+def set_hot_item(user_id, item):
+    HotItem.delete().where(HotItem.user == user_id).execute()
+    HotItem.create(user=user_id, item=item)
+
+
+async def burst(submit, user_ids, label):
+    start = perf_counter()
+    await asyncio.gather(
+        *(submit(set_hot_item, user_id, label) for user_id in user_ids)
+    )
+    return len(user_ids) / (perf_counter() - start)
+
+
+async def main(n):
+    migrate()
+    with db:
+        User.insert_many([{"discord_id": i} for i in range(n)]).execute()
+        user_ids = [u.id for u in User.select(User.id)]
+    before = await burst(db_pool.run, user_ids, "pool")
+    after = await burst(db_writer.submit, user_ids, "writer")
+    await db_writer.close()
+    print(f"{n} writes, {db_pool.workers} pool workers")
+    print(f"one transaction per write: {before:10.0f} writes/s")
+    print(
+        f"group commit:              {after:10.0f} writes/s "
+        f"({db_writer.batches} batches)"
+    )
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    asyncio.get_event_loop().run_until_complete(main(n))
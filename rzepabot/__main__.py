@@ -7,6 +7,10 @@ from __future__ import annotations
 
 from os import environ
 
-from rzepabot.bot import RzepaBot
+# Chart worker processes import this module too, but don't need the bot.
+if __name__ == "__main__":
+    from rzepabot.bot import RzepaBot
+    from rzepabot.migrations import check_schema
 
-RzepaBot().run(environ["RZEPABOT_TOKEN"])
+    check_schema()
+    RzepaBot().run(environ["RZEPABOT_TOKEN"])
@@ -8,6 +8,7 @@ from __future__ import annotations
 import asyncio
 import itertools
 import logging
+import signal
 from datetime import datetime
 import traceback
 import discord
@@ -15,9 +16,20 @@ import re
 from discord.ext import commands
 from discord.utils import oauth_url
 
+from rzepabot import cards, gamedata
+from rzepabot.charts import chart_renderer
 from rzepabot.config import RZEPABOT_PERMS
 from rzepabot.exceptions import RzepaException
-from rzepabot.persistence import Guild, db, cleanup
+from rzepabot.persistence import (
+    add_guild,
+    cleanup,
+    db_writer,
+    delete_guilds,
+    identity_cache,
+    prune_guilds,
+)
+from rzepabot.querylog import track_queries
+from rzepabot.plugins.admin import Admin
 from rzepabot.plugins.dodokod import Dodokod
 from rzepabot.plugins.profile import Profil
 from rzepabot.plugins.info import Info
@@ -25,9 +37,9 @@ from rzepabot.presence import get_presence, schedule_next_change
 
 logger = logging.getLogger()
 
-pl = logging.getLogger("peewee")
-pl.addHandler(logging.StreamHandler())
-pl.setLevel(logging.DEBUG)
+ql = logging.getLogger("rzepabot.querylog")
+ql.addHandler(logging.StreamHandler())
+ql.setLevel(logging.INFO)
 
 
 class RzepabotHelpPaginator(commands.Paginator):
@@ -155,9 +167,20 @@ class RzepaBot(commands.Bot):
             no_category="Brak kategorii",
             paginator=RzepabotHelpPaginator(),
         )
+        self.add_cog(Admin(self))
         self.add_cog(Dodokod(self))
         self.add_cog(Info(self))
         self.add_cog(Profil(self))
+        self._started = False
+        gamedata.load()
+        cards.load()
+        chart_renderer.start()
+
+    async def invoke(self, ctx):
+        if ctx.command is None:
+            return await super().invoke(ctx)
+        with track_queries(ctx.command.qualified_name), gamedata.pinned():
+            await super().invoke(ctx)
 
     def get_prefixes(self, _):
         return [self.user.mention, "$"]
@@ -165,14 +188,32 @@ class RzepaBot(commands.Bot):
     async def on_ready(self):
         print(f"Logged in as {self.user}")
         print(oauth_url(self.user.id, discord.Permissions(RZEPABOT_PERMS)))
-        with db:
-            guild_ids = Guild.select(Guild.discord_id)
-            joined_guilds = [g.id for g in self.guilds]
-            for guild in guild_ids:
-                if guild.discord_id not in joined_guilds:
-                    guild.delete_instance()
+        # on_ready fires again after every reconnect; from then on the guild
+        # table is kept up to date by on_guild_join and on_guild_remove.
+        if self._started:
+            return
+        self._started = True
+        for guild_id in await db_writer.submit(
+            prune_guilds, [g.id for g in self.guilds]
+        ):
+            identity_cache.forget_guild(guild_id)
         self.loop.create_task(self.manage_presence())
         self.loop.create_task(self.cleanup())
+        # `kill -HUP` reloads game data after update_game_data.py.
+        if hasattr(signal, "SIGHUP"):
+            self.loop.add_signal_handler(
+                signal.SIGHUP,
+                lambda: self.loop.create_task(self.on_sighup()),
+            )
+
+    async def on_guild_join(self, guild: discord.Guild):
+        identity_cache.guilds.put(
+            guild.id, await db_writer.submit(add_guild, guild.id)
+        )
+
+    async def on_guild_remove(self, guild: discord.Guild):
+        identity_cache.forget_guild(guild.id)
+        await db_writer.submit(delete_guilds, [guild.id])
 
     async def manage_presence(self):
         while True:
@@ -182,9 +223,29 @@ class RzepaBot(commands.Bot):
 
     async def cleanup(self):
         while True:
-            cleanup()
+            await cleanup()
             await asyncio.sleep(60 * 60)
 
+    async def reload_game_data(self) -> gamedata.GameData:
+        data = await gamedata.reload()
+        cards.load()
+        print(
+            f"Reloaded game data: {len(data.villagers)} villagers, "
+            f"{len(data.critters)} critters"
+        )
+        return data
+
+    async def on_sighup(self):
+        try:
+            await self.reload_game_data()
+        except Exception:
+            logger.exception("Reloading game data failed")
+
+    async def close(self):
+        await super().close()
+        await db_writer.close()
+        chart_renderer.shutdown()
+
     async def on_command_error(self, ctx, error):
         if isinstance(error, commands.CommandInvokeError):
             if isinstance(error.original, RzepaException):
@@ -193,6 +254,8 @@ class RzepaBot(commands.Bot):
             return await ctx.send(
                 "⚠️ Ta komenda może być użyta tylko na serwerze."
             )
+        elif isinstance(error, commands.NotOwner):
+            return
         elif isinstance(error, commands.MissingRequiredArgument):
             return await ctx.send(
                 f"⚠️ {ctx.author.mention}, musisz podać argument: `{error.param.name}`."
@@ -0,0 +1,164 @@
+# Copyright (c) 2020 Slavfox
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+from __future__ import annotations
+
+from typing import Callable, Dict, Hashable, Optional, TypeVar
+
+from array import array
+from time import time
+
+T = TypeVar("T")
+
+_NIL = -1
+
+
+class IntLRU:
+    """
+    Fixed-capacity LRU map from 64-bit integers to 64-bit integers.
+
+    Keys, values and the doubly-linked recency list are stored in arrays
+    which grow up to ``capacity`` entries, so an entry costs a few machine
+    words plus its slot in the key -> slot dict, instead of a pair of boxed
+    ints in an OrderedDict node.
+    """
+
+    __slots__ = (
+        "capacity",
+        "_keys",
+        "_values",
+        "_prev",
+        "_next",
+        "_slots",
+        "_head",
+        "_tail",
+        "_free",
+    )
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self._keys = array("q")
+        self._values = array("q")
+        self._prev = array("l")
+        self._next = array("l")
+        self._slots = {}
+        # Most and least recently used slots.
+        self._head = _NIL
+        self._tail = _NIL
+        # Singly-linked list of slots freed by pop(), threaded through _next.
+        self._free = _NIL
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, key: int):
+        return key in self._slots
+
+    def get(self, key: int, default: Optional[int] = None) -> Optional[int]:
+        slot = self._slots.get(key)
+        if slot is None:
+            return default
+        if slot != self._head:
+            self._unlink(slot)
+            self._push_front(slot)
+        return self._values[slot]
+
+    def put(self, key: int, value: int):
+        slot = self._slots.get(key)
+        if slot is not None:
+            self._unlink(slot)
+        else:
+            slot = self._allocate()
+            self._keys[slot] = key
+            self._slots[key] = slot
+        self._values[slot] = value
+        self._push_front(slot)
+
+    def pop(self, key: int, default: Optional[int] = None) -> Optional[int]:
+        slot = self._slots.pop(key, None)
+        if slot is None:
+            return default
+        self._unlink(slot)
+        self._next[slot] = self._free
+        self._free = slot
+        return self._values[slot]
+
+    def clear(self):
+        self.__init__(self.capacity)
+
+    def _allocate(self) -> int:
+        if self._free != _NIL:
+            slot = self._free
+            self._free = self._next[slot]
+            return slot
+        if len(self._keys) < self.capacity:
+            for a in (self._keys, self._values, self._prev, self._next):
+                a.append(_NIL)
+            return len(self._keys) - 1
+        # Evict the least recently used entry.
+        slot = self._tail
+        self._unlink(slot)
+        del self._slots[self._keys[slot]]
+        return slot
+
+    def _unlink(self, slot: int):
+        prev, next_ = self._prev[slot], self._next[slot]
+        if prev != _NIL:
+            self._next[prev] = next_
+        else:
+            self._head = next_
+        if next_ != _NIL:
+            self._prev[next_] = prev
+        else:
+            self._tail = prev
+        self._prev[slot] = self._next[slot] = _NIL
+
+    def _push_front(self, slot: int):
+        self._prev[slot] = _NIL
+        self._next[slot] = self._head
+        if self._head != _NIL:
+            self._prev[self._head] = slot
+        self._head = slot
+        if self._tail == _NIL:
+            self._tail = slot
+
+
+class HourlyCache:
+    """
+    Memoizes values which stay valid until the next full hour, when every
+    entry is dropped at once.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time):
+        self._clock = clock
+        self._entries: Dict[Hashable, object] = {}
+        self._hour = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key: Hashable, build: Callable[[], T]) -> T:
+        """Returns the value cached under ``key``, building it if needed."""
+        hour = int(self._clock() // 3600)
+        if hour != self._hour:
+            self._entries.clear()
+            self._hour = hour
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            value = self._entries[key] = build()
+        else:
+            self.hits += 1
+        return value
@@ -0,0 +1,136 @@
+# Copyright (c) 2020 Slavfox
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+Amiibo card dumps, packed into a single archive by update_game_data.py.
+
+Layout, little-endian:
+
+    header  magic, version, number of cards
+    index   offset and size of every card, length of its name, the name
+            (UTF-8)
+    cards   card dumps, back to back
+
+The bot memory-maps the archive, so sending a card doesn't touch the
+filesystem.
+"""
+from __future__ import annotations
+
+from typing import Dict, Iterator, Optional, Tuple
+
+import io
+import mmap
+import os
+import struct
+from collections import OrderedDict
+
+from rzepabot.config import CARD_CACHE_SIZE, CARDS_PATH
+
+MAGIC = b"RZCA"
+VERSION = 1
+HEADER = struct.Struct("<4sBI")
+ENTRY = struct.Struct("<QIH")
+
+
+def pack(cards: Dict[str, bytes]) -> bytes:
+    names = [name.encode() for name in cards]
+    offset = HEADER.size + sum(ENTRY.size + len(name) for name in names)
+    index = []
+    for name, card in zip(names, cards.values()):
+        index += [ENTRY.pack(offset, len(card), len(name)), name]
+        offset += len(card)
+    return b"".join(
+        [HEADER.pack(MAGIC, VERSION, len(cards)), *index, *cards.values()]
+    )
+
+
+def write(cards: Dict[str, bytes], path: str = CARDS_PATH):
+    """Replaces the archive, so that running bots keep their mapping."""
+    new_path = f"{path}.new"
+    with open(new_path, "wb") as f:
+        f.write(pack(cards))
+    os.replace(new_path, path)
+
+
+class CardArchive:
+    """
+    Cards by villager name, read from a packed archive, with the most
+    recently used ones kept in memory.
+    """
+
+    def __init__(self, data=b"", cache_size: int = CARD_CACHE_SIZE):
+        # bytes, or an mmap of the archive file.
+        self._data = data
+        self._index: Dict[str, Tuple[int, int]] = {}
+        self._cache: OrderedDict[str, bytes] = OrderedDict()
+        self._cache_size = cache_size
+        if not data:
+            return
+        magic, version, count = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Unsupported card archive version {version}.")
+        offset = HEADER.size
+        for _ in range(count):
+            start, size, name_size = ENTRY.unpack_from(data, offset)
+            offset += ENTRY.size
+            name = data[offset : offset + name_size].decode()
+            offset += name_size
+            self._index[name] = (start, size)
+
+    @classmethod
+    def open(cls, path: str = CARDS_PATH) -> CardArchive:
+        """Maps the archive, or returns an empty one if it doesn't exist."""
+        try:
+            with open(path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return cls()
+        return cls(data)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, name: str):
+        return name in self._index
+
+    def items(self) -> Iterator[Tuple[str, bytes]]:
+        for name, (start, size) in self._index.items():
+            yield name, self._data[start : start + size]
+
+    def get(self, name: str) -> Optional[bytes]:
+        try:
+            card = self._cache[name]
+        except KeyError:
+            if name not in self._index:
+                return None
+            start, size = self._index[name]
+            card = self._cache[name] = self._data[start : start + size]
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(name)
+        return card
+
+    def file(self, name: str) -> Optional[io.BytesIO]:
+        """
+        The card as a file object. BytesIO shares the cached bytes instead of
+        copying them, as long as nothing writes to it.
+        """
+        card = self.get(name)
+        return None if card is None else io.BytesIO(card)
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+
+archive = CardArchive()
+
+
+def load():
+    """(Re)opens the archive, e.g. after update_game_data.py replaced it."""
+    global archive
+    previous, archive = archive, CardArchive.open()
+    previous.close()
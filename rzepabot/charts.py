@@ -0,0 +1,210 @@
+# Copyright (c) 2020 Slavfox
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+Turnip price charts, rendered to PNG in worker processes.
+
+Charts are drawn on their own Figure with the Agg canvas rather than
+through pyplot, so no global state is shared between renders. Rendering
+still takes long enough to stall the event loop, so ChartRenderer runs it
+in a pool of worker processes. Workers import this module, so it mustn't
+import the database or the cogs.
+"""
+from __future__ import annotations
+
+from typing import Optional, Sequence
+
+import asyncio
+import io
+import multiprocessing
+import queue
+import time
+from datetime import datetime
+
+import matplotlib.dates as mdates
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from rzepabot.config import CHART_TIMEOUT_S, CHART_WORKERS
+from rzepabot.exceptions import RzepaException
+
+
+def draw_prices(
+    dates: Sequence[datetime],
+    prices: Sequence[int],
+    buy_price: Optional[int] = None,
+) -> Figure:
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    ax.plot(dates, prices, "o-", label="Cena sprzedaży u Nooklingów")
+    ax.xaxis.set_major_locator(mdates.DayLocator())
+    # Prices change at noon. Hourly ticks made up most of the render time.
+    ax.xaxis.set_minor_locator(mdates.HourLocator(byhour=12))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter("%d/%m"))
+    if buy_price:
+        ax.plot(
+            dates, [buy_price for _ in dates], label="Cena kupna u Daisy"
+        )
+    for date, price in zip(dates, prices):
+        ax.annotate(
+            str(price), (date, price), (0, 10), textcoords="offset pixels"
+        )
+    ax.set_ylabel("Dzwoneczki")
+    fig.autofmt_xdate()
+    ax.grid(axis="y")
+    fig.tight_layout()
+    return fig
+
+
+def render_prices(
+    dates: Sequence[datetime],
+    prices: Sequence[int],
+    buy_price: Optional[int] = None,
+) -> bytes:
+    """The chart as PNG, ready to be sent as a discord.File."""
+    buffer = io.BytesIO()
+    draw_prices(dates, prices, buy_price).savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+def warm_up():
+    # Loads fonts and the Agg renderer, so the first real chart doesn't
+    # pay for them.
+    render_prices([datetime(2020, 4, 6, 6)], [100], 100)
+
+
+def serve(connection):
+    """Worker process loop: renders every job sent down the pipe."""
+    warm_up()
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            return
+        try:
+            result = True, render_prices(*job)
+        except Exception as e:
+            result = False, e
+        connection.send(result)
+
+
+class ChartWorker:
+    """A worker process and the pipe it takes jobs from."""
+
+    def __init__(self, context):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(
+            target=serve, args=(child,), daemon=True
+        )
+        self.process.start()
+        child.close()
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+
+class ChartRenderer:
+    """
+    Renders charts in worker processes, started and warmed up in advance.
+    Each worker renders one chart at a time. A render that takes longer
+    than ``timeout`` seconds fails and only its worker is replaced; a
+    worker that died is replaced and the render retried once.
+    """
+
+    def __init__(
+        self, workers: int = CHART_WORKERS, timeout: float = CHART_TIMEOUT_S
+    ):
+        self.workers = workers
+        self.timeout = timeout
+        self._context = None
+        self._idle: queue.Queue[ChartWorker] = queue.Queue()
+
+    def start(self):
+        # Workers are forked from a server process which only imports this
+        # module, rather than from the bot with its threads and connections.
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload([__name__])
+        else:
+            context = multiprocessing.get_context("spawn")
+        self._context = context
+        for _ in range(self.workers):
+            self._idle.put(ChartWorker(context))
+
+    def shutdown(self):
+        # Busy workers are stopped when they finish, see _release().
+        self._context = None
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                return
+
+    def _release(self, worker: ChartWorker):
+        if self._context is None:
+            worker.stop()
+        else:
+            self._idle.put(worker)
+
+    def _replace(self, worker: ChartWorker):
+        worker.stop()
+        if self._context is not None:
+            self._idle.put(ChartWorker(self._context))
+
+    def _render(self, job) -> bytes:
+        # Waiting for a free worker counts towards the timeout too.
+        deadline = time.monotonic() + self.timeout
+        try:
+            worker = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RzepaException("Rysowanie wykresu trwało zbyt długo.")
+        for attempt in range(2):
+            if attempt:
+                # The worker died, so retry once on a new one.
+                worker.stop()
+                if self._context is None:
+                    break
+                worker = ChartWorker(self._context)
+            try:
+                worker.connection.send(job)
+                # Also returns if the worker died, and then recv() fails.
+                if not worker.connection.poll(
+                    max(deadline - time.monotonic(), 0)
+                ):
+                    self._replace(worker)
+                    raise RzepaException(
+                        "Rysowanie wykresu trwało zbyt długo."
+                    )
+                succeeded, result = worker.connection.recv()
+            except (EOFError, OSError):
+                continue
+            self._release(worker)
+            if not succeeded:
+                raise result
+            return result
+        self._replace(worker)
+        raise RzepaException("Nie udało się narysować wykresu.")
+
+    async def render(
+        self,
+        dates: Sequence[datetime],
+        prices: Sequence[int],
+        buy_price: Optional[int] = None,
+    ) -> bytes:
+        if self._context is None:
+            self.start()
+        # Waits for the worker in a thread, so the event loop doesn't.
+        return await asyncio.get_event_loop().run_in_executor(
+            None, self._render, (dates, prices, buy_price)
+        )
+
+
+chart_renderer = ChartRenderer()
@@ -22,6 +22,41 @@ RZEPABOT_PREFIX = environ.get(
     "RZEPABOT_DB", str(RZEPABOT_ROOT / "rzepabot.db")
 )
 DB_PATH = environ.get("RZEPABOT_DB", str(RZEPABOT_ROOT / "rzepabot.db"))
+# Game data (villagers, critters), built by update_game_data.py and attached
+# read-only to every connection.
+STATIC_DB_PATH = environ.get(
+    "RZEPABOT_STATIC_DB", str(Path(DB_PATH).parent / "rzepabot_static.db")
+)
+# Amiibo card dumps, packed into one file by update_game_data.py.
+CARDS_PATH = environ.get(
+    "RZEPABOT_CARDS", str(RZEPABOT_ROOT / "rzepabot" / "data" / "cards.bin")
+)
+# Number of most recently sent cards kept in memory.
+CARD_CACHE_SIZE = int(environ.get("RZEPABOT_CARD_CACHE_SIZE", 32))
+# SQLite tuning, applied to every (long-lived) connection.
+DB_JOURNAL_MODE = environ.get("RZEPABOT_DB_JOURNAL_MODE", "wal")
+DB_SYNCHRONOUS = environ.get("RZEPABOT_DB_SYNCHRONOUS", "normal")
+DB_CACHE_SIZE_KB = int(environ.get("RZEPABOT_DB_CACHE_SIZE_KB", 16 * 1024))
+DB_MMAP_SIZE = int(environ.get("RZEPABOT_DB_MMAP_SIZE", 128 * 1024 * 1024))
+DB_BUSY_TIMEOUT_MS = int(environ.get("RZEPABOT_DB_BUSY_TIMEOUT_MS", 5000))
+# Number of threads running blocking database queries.
+DB_WORKERS = int(environ.get("RZEPABOT_DB_WORKERS", 4))
+# Queries that waited longer than this for a free worker get logged.
+DB_WAIT_WARNING_MS = float(environ.get("RZEPABOT_DB_WAIT_WARNING_MS", 100))
+# Writes queued within this window are committed in a single transaction.
+DB_COMMIT_WINDOW_MS = float(environ.get("RZEPABOT_DB_COMMIT_WINDOW_MS", 5))
+DB_MAX_BATCH = int(environ.get("RZEPABOT_DB_MAX_BATCH", 256))
+# Queries taking at least this long are logged along with their command.
+SQL_SLOW_QUERY_MS = float(environ.get("RZEPABOT_SQL_SLOW_QUERY_MS", 50))
+# Fraction of command invocations whose query counts and times get logged.
+SQL_SAMPLE_RATE = float(environ.get("RZEPABOT_SQL_SAMPLE_RATE", 0.01))
+# Maximum number of users, guilds and memberships whose row ids are cached.
+IDENTITY_CACHE_SIZE = int(environ.get("RZEPABOT_IDENTITY_CACHE_SIZE", 65536))
+# Number of turnip forecasts kept in memory, on top of the database.
+FORECAST_CACHE_SIZE = int(environ.get("RZEPABOT_FORECAST_CACHE_SIZE", 4096))
+# Processes rendering charts, and how long a chart may take to render.
+CHART_WORKERS = int(environ.get("RZEPABOT_CHART_WORKERS", 2))
+CHART_TIMEOUT_S = float(environ.get("RZEPABOT_CHART_TIMEOUT_S", 5))
 tznow_dt = lambda: now("Europe/Warsaw")
 tznow_t = lambda: now("Europe/Warsaw").time()
 RZEPABOT_PERMS = 379968
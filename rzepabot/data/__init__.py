@@ -3,8 +3,29 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+Game data: ``villagers``, ``fish`` and ``bugs``.
+
+They're loaded on first access, from the binary bundle if it's up to date
+(see rzepabot.data.bundle), otherwise by importing the source modules.
+"""
 from __future__ import annotations
 
-from rzepabot.data.bugs import bugs
-from rzepabot.data.fish import fish
-from rzepabot.data.villagers import villagers
+__all__ = ["villagers", "fish", "bugs"]
+
+
+def __getattr__(name):
+    if name not in __all__:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from rzepabot.data import bundle
+
+    try:
+        villagers, fish, bugs = bundle.load()
+    except bundle.StaleBundle:
+        from rzepabot.data.bugs import bugs
+        from rzepabot.data.fish import fish
+        from rzepabot.data.villagers import villagers
+    # Importing the submodules above binds their names here too, so these
+    # have to be set afterwards.
+    globals().update(villagers=villagers, fish=fish, bugs=bugs)
+    return globals()[name]
@@ -0,0 +1,176 @@
+# Copyright (c) 2020 Slavfox
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+Packs the game data sources (villagers.py, fish.py, bugs.py) into a single
+binary file, which loads much faster than importing them.
+
+Build it with:
+
+    poetry run python -m rzepabot.data.bundle
+
+Layout, little-endian:
+
+    header      magic, version, string table size, villager and critter counts
+    strings     every distinct string, UTF-8, separated by NUL bytes
+    villagers   name, image url, personality, species, catchphrase (string
+                indices), birthday month and day
+    critters    name, location (string indices), price (-1 for unknown),
+                hour mask, month mask, is fish
+"""
+from __future__ import annotations
+
+from typing import Dict, List, Tuple
+
+import os
+import struct
+from pathlib import Path
+
+DATA_DIR = Path(__file__).parent
+BUNDLE_PATH = DATA_DIR / "gamedata.bin"
+SOURCES = [DATA_DIR / f"{name}.py" for name in ("villagers", "fish", "bugs")]
+
+MAGIC = b"RZGD"
+VERSION = 1
+HEADER = struct.Struct("<4sBIHH")
+VILLAGER = struct.Struct("<HHHHHBB")
+CRITTER = struct.Struct("<HHiIH?")
+
+
+class StaleBundle(Exception):
+    pass
+
+
+def is_fresh() -> bool:
+    """Whether the bundle exists and is newer than all of its sources."""
+    try:
+        built = BUNDLE_PATH.stat().st_mtime
+    except FileNotFoundError:
+        return False
+    return all(source.stat().st_mtime <= built for source in SOURCES)
+
+
+def pack(villagers, fish, bugs) -> bytes:
+    strings: Dict[str, int] = {}
+
+    def string(s):
+        return strings.setdefault(s, len(strings))
+
+    villager_records = [
+        VILLAGER.pack(
+            string(name),
+            string(image_url),
+            string(personality),
+            string(species),
+            string(catchphrase),
+            month,
+            day,
+        )
+        for (
+            name,
+            image_url,
+            personality,
+            species,
+            (month, day),
+            catchphrase,
+        ) in villagers
+    ]
+    critter_records = [
+        CRITTER.pack(
+            string(name),
+            string(location),
+            -1 if price is None else price,
+            hour_mask,
+            month_mask,
+            is_fish,
+        )
+        for rows, is_fish in ((fish, True), (bugs, False))
+        for name, price, location, hour_mask, month_mask in rows
+    ]
+    string_table = "\0".join(strings).encode()
+    return b"".join(
+        [
+            HEADER.pack(
+                MAGIC,
+                VERSION,
+                len(string_table),
+                len(villager_records),
+                len(critter_records),
+            ),
+            string_table,
+            *villager_records,
+            *critter_records,
+        ]
+    )
+
+
+def unpack(data: bytes) -> Tuple[List[tuple], List[tuple], List[tuple]]:
+    """Returns the villagers, fish and bugs, shaped like in the sources."""
+    magic, version, strings_size, n_villagers, n_critters = HEADER.unpack_from(
+        data
+    )
+    if magic != MAGIC or version != VERSION:
+        raise StaleBundle(f"Unsupported game data bundle version {version}.")
+    offset = HEADER.size
+    strings = data[offset : offset + strings_size].decode().split("\0")
+    offset += strings_size
+    villagers_end = offset + n_villagers * VILLAGER.size
+    villagers = [
+        (
+            strings[name],
+            strings[image_url],
+            strings[personality],
+            strings[species],
+            (month, day),
+            strings[catchphrase],
+        )
+        for (
+            name,
+            image_url,
+            personality,
+            species,
+            catchphrase,
+            month,
+            day,
+        ) in VILLAGER.iter_unpack(data[offset:villagers_end])
+    ]
+    fish, bugs = [], []
+    critters_end = villagers_end + n_critters * CRITTER.size
+    for name, location, price, hour_mask, month_mask, is_fish in (
+        CRITTER.iter_unpack(data[villagers_end:critters_end])
+    ):
+        (fish if is_fish else bugs).append(
+            (
+                strings[name],
+                None if price == -1 else price,
+                strings[location],
+                hour_mask,
+                month_mask,
+            )
+        )
+    return villagers, fish, bugs
+
+
+def load() -> Tuple[List[tuple], List[tuple], List[tuple]]:
+    if not is_fresh():
+        raise StaleBundle(f"{BUNDLE_PATH} is missing or out of date.")
+    return unpack(BUNDLE_PATH.read_bytes())
+
+
+def build():
+    from rzepabot.data.bugs import bugs
+    from rzepabot.data.fish import fish
+    from rzepabot.data.villagers import villagers
+
+    data = pack(villagers, fish, bugs)
+    new_path = BUNDLE_PATH.with_suffix(".new")
+    new_path.write_bytes(data)
+    os.replace(new_path, BUNDLE_PATH)
+    return data
+
+
+if __name__ == "__main__":
+    data = build()
+    print(f"Wrote {len(data)} bytes to {BUNDLE_PATH}.")
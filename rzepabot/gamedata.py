@@ -0,0 +1,337 @@
+# Copyright (c) 2020 Slavfox
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+In-memory indexes over the game data database.
+
+Game data only changes when update_game_data.py is run, so it's read once
+by load() and commands look it up here instead of querying SQLite. reload()
+picks up a new game data file while the bot is running.
+"""
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import unicodedata
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, timedelta
+from itertools import accumulate
+from pathlib import Path
+from urllib.parse import quote
+
+from rzepabot.config import STATIC_DB_PATH, depoliszifaj
+from rzepabot.persistence import (
+    Critter,
+    Villager,
+    db,
+    db_pool,
+    reload_static,
+    transaction,
+)
+from rzepabot.search import SearchIndex
+
+# Alternative names villagers can be looked up by, alias -> name.
+VILLAGER_ALIASES: Dict[str, str] = {}
+
+
+def normalize_name(name: str) -> str:
+    """Casefolds a name and strips its diacritics."""
+    name = depoliszifaj(name.strip().casefold())
+    return "".join(
+        c
+        for c in unicodedata.normalize("NFKD", name)
+        if not unicodedata.combining(c)
+    )
+
+
+class CritterRow(NamedTuple):
+    name: str
+    price: Optional[int]
+    location: str
+    time_mask: int
+    month_mask: int
+
+
+class CritterIndex:
+    """
+    Critters available in every month and hour, most expensive first.
+
+    Months are numbered from 0, like the bits of ``month_mask``.
+    """
+
+    def __init__(self, critters: Iterable[Tuple[bool, CritterRow]]):
+        critters = list(critters)
+        self._count = len(critters)
+        self._by_month: Dict[Tuple[bool, int], Tuple[CritterRow, ...]] = {}
+        self._by_hour: Dict[
+            Tuple[bool, int, int], Tuple[CritterRow, ...]
+        ] = {}
+        self._new: Dict[Tuple[bool, int], Tuple[CritterRow, ...]] = {}
+        self._leaving: Dict[Tuple[bool, int], Tuple[CritterRow, ...]] = {}
+        for is_fish in (True, False):
+            kind = [row for fish, row in critters if fish == is_fish]
+            kind.sort(
+                key=lambda row: -1 if row.price is None else row.price,
+                reverse=True,
+            )
+            for month in range(12):
+                previous_month = 1 << (month - 1) % 12
+                next_month = 1 << (month + 1) % 12
+                available = tuple(
+                    row for row in kind if row.month_mask & 1 << month
+                )
+                self._by_month[is_fish, month] = available
+                self._new[is_fish, month] = tuple(
+                    row
+                    for row in available
+                    if not row.month_mask & previous_month
+                )
+                self._leaving[is_fish, month] = tuple(
+                    row for row in available if not row.month_mask & next_month
+                )
+                for hour in range(24):
+                    self._by_hour[is_fish, month, hour] = tuple(
+                        row for row in available if row.time_mask & 1 << hour
+                    )
+
+    def __len__(self):
+        return self._count
+
+    def available(
+        self, is_fish: bool, month: int, hour: Optional[int] = None
+    ) -> Tuple[CritterRow, ...]:
+        if hour is None:
+            return self._by_month[is_fish, month]
+        return self._by_hour[is_fish, month, hour]
+
+    def new(self, is_fish: bool, month: int) -> Tuple[CritterRow, ...]:
+        """Critters which weren't available in the previous month."""
+        return self._new[is_fish, month]
+
+    def leaving(self, is_fish: bool, month: int) -> Tuple[CritterRow, ...]:
+        """Critters which won't be available in the next month."""
+        return self._leaving[is_fish, month]
+
+
+class VillagerRecord:
+    __slots__ = (
+        "id",
+        "name",
+        "catchphrase",
+        "birthday_month",
+        "birthday_day",
+        "personality",
+        "species",
+        "image_url",
+    )
+
+    def __init__(
+        self,
+        id,
+        name,
+        catchphrase,
+        birthday_month,
+        birthday_day,
+        personality,
+        species,
+        image_url,
+    ):
+        self.id = id
+        self.name = name
+        self.catchphrase = catchphrase
+        self.birthday_month = birthday_month
+        self.birthday_day = birthday_day
+        self.personality = personality
+        self.species = species
+        self.image_url = image_url
+
+    def __repr__(self):
+        return f"<VillagerRecord: {self.name}>"
+
+    @property
+    def link(self):
+        return (
+            f"[{self.name}](https://animalcrossing.fandom.com/wiki/"
+            f"{quote(self.name)})"
+        )
+
+
+# Index of the first day of every month in a leap year, plus its length.
+MONTH_STARTS = list(
+    accumulate([0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+)
+
+
+def day_of_year(month: int, day: int) -> int:
+    """0-based day of a leap year, so that every date has its own slot."""
+    return MONTH_STARTS[month - 1] + day - 1
+
+
+class BirthdayCalendar:
+    """Villagers by birthday, in one slot for every day of a leap year."""
+
+    def __init__(self, villagers: Iterable[VillagerRecord]):
+        days = [[] for _ in range(MONTH_STARTS[-1])]
+        for v in villagers:
+            days[day_of_year(v.birthday_month, v.birthday_day)].append(v)
+        self._days = [
+            tuple(sorted(day, key=lambda v: v.name)) for day in days
+        ]
+
+    def on(self, month: int, day: int) -> Tuple[VillagerRecord, ...]:
+        return self._days[day_of_year(month, day)]
+
+    def in_month(self, month: int) -> List[VillagerRecord]:
+        """Villagers with birthdays in the given month, by day."""
+        month_days = self._days[MONTH_STARTS[month - 1] : MONTH_STARTS[month]]
+        return [v for day in month_days for v in day]
+
+    def upcoming(
+        self, start: date, days: int
+    ) -> List[Tuple[date, Tuple[VillagerRecord, ...]]]:
+        """
+        Dates within ``days`` days from ``start`` (inclusive) on which some
+        villagers have birthdays, continuing into the next year if needed.
+        """
+        upcoming = []
+        for i in range(days):
+            day = start + timedelta(days=i)
+            villagers = self.on(day.month, day.day)
+            if villagers:
+                upcoming.append((day, villagers))
+        return upcoming
+
+
+class VillagerCatalog:
+    """Villagers by row id and by normalized name or alias."""
+
+    def __init__(
+        self,
+        villagers: Iterable[VillagerRecord],
+        aliases: Dict[str, str] = VILLAGER_ALIASES,
+    ):
+        self.villagers: List[VillagerRecord] = sorted(
+            villagers, key=lambda v: v.name
+        )
+        self._by_id = {v.id: v for v in self.villagers}
+        self._by_name = {normalize_name(v.name): v for v in self.villagers}
+        for alias, name in aliases.items():
+            villager = self._by_name.get(normalize_name(name))
+            if villager is not None:
+                self._by_name.setdefault(normalize_name(alias), villager)
+        self._search = SearchIndex(self._by_name.items())
+        self.birthdays = BirthdayCalendar(self.villagers)
+
+    def __len__(self):
+        return len(self.villagers)
+
+    def get(self, name: str) -> Optional[VillagerRecord]:
+        return self._by_name.get(normalize_name(name))
+
+    def by_id(self, villager_id: int) -> Optional[VillagerRecord]:
+        return self._by_id.get(villager_id)
+
+    def search(self, query: str) -> List[VillagerRecord]:
+        """Villagers whose name or alias contains the query, best first."""
+        # Villagers with aliases can match more than once.
+        return list(
+            dict.fromkeys(self._search.substring(normalize_name(query)))
+        )
+
+    def suggest(self, query: str, limit: int = 5) -> List[VillagerRecord]:
+        """Villagers whose name or alias is close to the query."""
+        return list(
+            dict.fromkeys(self._search.suggest(normalize_name(query), limit))
+        )
+
+
+class GameData(NamedTuple):
+    critters: CritterIndex
+    villagers: VillagerCatalog
+
+
+_current = GameData(CritterIndex(()), VillagerCatalog(()))
+_pinned: ContextVar[Optional[GameData]] = ContextVar(
+    "pinned_game_data", default=None
+)
+
+
+def snapshot() -> GameData:
+    """The snapshot pinned by the running command, or the current one."""
+    return _pinned.get() or _current
+
+
+def __getattr__(name):
+    # gamedata.critters and gamedata.villagers
+    if name in GameData._fields:
+        return getattr(snapshot(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@contextmanager
+def pinned():
+    """
+    Keeps gamedata.critters and gamedata.villagers on the current snapshot
+    within the block (and database jobs it starts), even if reload() swaps
+    in a new one in the meantime.
+    """
+    token = _pinned.set(snapshot())
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+def read() -> GameData:
+    """Builds the indexes from the game data database."""
+    villager_rows = list(
+        Villager.select(
+            Villager.id,
+            Villager.name,
+            Villager.catchphrase,
+            Villager.birthday_month,
+            Villager.birthday_day,
+            Villager.personality,
+            Villager.species,
+            Villager.image_url,
+        ).tuples()
+    )
+    critter_rows = [
+        (row[0], CritterRow(*row[1:]))
+        for row in Critter.select(
+            Critter.is_fish,
+            Critter.name,
+            Critter.price,
+            Critter.location,
+            Critter.time_mask,
+            Critter.month_mask,
+        ).tuples()
+    ]
+    return GameData(
+        CritterIndex(critter_rows),
+        VillagerCatalog(VillagerRecord(*row) for row in villager_rows),
+    )
+
+
+def load():
+    """Loads game data at startup."""
+    global _current
+    with transaction(db):
+        _current = read()
+
+
+async def reload() -> GameData:
+    """
+    Loads game data from the file replaced by update_game_data.py and swaps
+    it in, without restarting the bot. Commands already running finish on
+    the snapshot they started with.
+    """
+    global _current
+    if not Path(STATIC_DB_PATH).exists():
+        raise FileNotFoundError(STATIC_DB_PATH)
+    reload_static()
+    _current = await db_pool.run(read)
+    return _current
@@ -0,0 +1,194 @@
+# Copyright (c) 2020 Slavfox
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+Versioned schema migrations.
+
+Run once per deploy, before starting the bot:
+
+    poetry run python -m rzepabot.migrations
+
+Migration 1 creates the schema from the current model definitions, so every
+later migration has to be a no-op on a database created that way.
+
+Migrations can write to the game data database, which the bot itself only
+ever attaches read-only.
+"""
+from __future__ import annotations
+
+from typing import Callable, List, Tuple
+
+from pathlib import Path
+
+from peewee import DateTimeField, IntegerField
+
+from rzepabot.config import STATIC_DB_PATH
+from rzepabot.persistence import (
+    BaseModel,
+    Critter,
+    DodoCode,
+    HotItem,
+    MuseumCritter,
+    Residency,
+    StalkPrice,
+    TurnipForecast,
+    Villager,
+    attach_static,
+    db,
+    dt_default,
+    models,
+    transaction,
+)
+
+MIGRATIONS: List[Tuple[int, Callable[[], None]]] = []
+
+
+class SchemaVersion(BaseModel):
+    version = IntegerField(primary_key=True)
+    applied_at = DateTimeField(default=dt_default)
+
+
+class SchemaOutdated(RuntimeError):
+    pass
+
+
+def migration(version: int):
+    def register(func):
+        assert not MIGRATIONS or MIGRATIONS[-1][0] == version - 1
+        MIGRATIONS.append((version, func))
+        return func
+
+    return register
+
+
+@migration(1)
+def create_tables():
+    # Databases from before versioning only ever got create_tables(), which
+    # doesn't add columns to existing tables.
+    # SQLite date modifiers matching each model's expires_at default.
+    for model, lifetime in (
+        (StalkPrice, ("+1 month",)),
+        (HotItem, ("start of day", "+1 day")),
+        (DodoCode, ("+1 day",)),
+    ):
+        table = model._meta.table_name
+        if not db.table_exists(table) or "expires_at" in {
+            column.name for column in db.get_columns(table)
+        }:
+            continue
+        db.execute_sql(
+            f'ALTER TABLE "{table}" ADD COLUMN "expires_at" DATETIME'
+        )
+        modifiers = ", ".join("?" * len(lifetime))
+        db.execute_sql(
+            f'UPDATE "{table}" '
+            f'SET "expires_at" = datetime("timestamp", {modifiers})',
+            lifetime,
+        )
+    db.create_tables(models)
+
+
+def _columns(model) -> str:
+    return ", ".join(
+        f'"{field.column_name}"' for field in model._meta.sorted_fields
+    )
+
+
+def _rebuild_table(model):
+    """Recreates a table from its model, keeping its rows."""
+    table = model._meta.table_name
+    old = f"{table}_old"
+    db.execute_sql(f'ALTER TABLE "{table}" RENAME TO "{old}"')
+    # Indexes keep their names when their table is renamed.
+    for index in db.get_indexes(old):
+        if index.sql:
+            db.execute_sql(f'DROP INDEX "{index.name}"')
+    model.create_table()
+    columns = _columns(model)
+    db.execute_sql(
+        f'INSERT INTO "{table}" ({columns}) SELECT {columns} FROM "{old}"'
+    )
+    db.execute_sql(f'DROP TABLE "{old}"')
+
+
+@migration(2)
+def move_game_data():
+    # Villagers and critters move to the static database. Their ids are
+    # kept, since residencies and museum critters refer to them, but those
+    # foreign keys can't be enforced across databases any more.
+    db.create_tables([Villager, Critter])
+    if not db.table_exists(Villager._meta.table_name):
+        return
+    for model in (Residency, MuseumCritter):
+        _rebuild_table(model)
+    for model in (Villager, Critter):
+        table = model._meta.table_name
+        columns = _columns(model)
+        db.execute_sql(
+            f'INSERT OR IGNORE INTO "{model._meta.schema}"."{table}" '
+            f'({columns}) SELECT {columns} FROM "main"."{table}"'
+        )
+        db.execute_sql(f'DROP TABLE "main"."{table}"')
+
+
+@migration(3)
+def create_turnip_forecasts():
+    db.create_tables([TurnipForecast])
+
+
+def latest_version() -> int:
+    return MIGRATIONS[-1][0]
+
+
+def current_version() -> int:
+    if not SchemaVersion.table_exists():
+        return 0
+    return SchemaVersion.select(SchemaVersion.version).order_by(
+        SchemaVersion.version.desc()
+    ).scalar() or 0
+
+
+def migrate() -> List[int]:
+    """Applies every pending migration. Returns the applied versions."""
+    applied = []
+    attach_static(writable=True)
+    try:
+        with transaction(db):
+            db.create_tables([SchemaVersion])
+            current = current_version()
+            for version, func in MIGRATIONS:
+                if version <= current:
+                    continue
+                func()
+                SchemaVersion.create(version=version)
+                applied.append(version)
+    finally:
+        attach_static()
+    return applied
+
+
+def check_schema():
+    """Raises SchemaOutdated if there are migrations left to apply."""
+    if not Path(STATIC_DB_PATH).exists():
+        raise SchemaOutdated(
+            f"Game data database {STATIC_DB_PATH} doesn't exist. "
+            f"Run `python -m rzepabot.migrations` and "
+            f"`python update_game_data.py`."
+        )
+    with transaction(db):
+        current = current_version()
+    if current < latest_version():
+        raise SchemaOutdated(
+            f"Database schema is at version {current}, but the bot needs "
+            f"version {latest_version()}. "
+            f"Run `python -m rzepabot.migrations`."
+        )
+
+
+if __name__ == "__main__":
+    applied = migrate()
+    if applied:
+        print(f"Applied migrations: {', '.join(map(str, applied))}.")
+    print(f"Schema is at version {latest_version()}.")
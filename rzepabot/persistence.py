@@ -5,13 +5,21 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 from __future__ import annotations
 
-from typing import Set
+from typing import Callable, List, Optional, Set, Tuple, TypeVar
 from dataclasses import dataclass
 
-from datetime import datetime
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from time import perf_counter
 from urllib.parse import quote
 
 from peewee import (
+    BlobField,
     BooleanField,
     CharField,
     Check,
@@ -23,17 +31,128 @@ from peewee import (
     ManyToManyField,
     Model,
     SqliteDatabase,
+    Table,
     TextField,
     TimeField,
 )
 
-from rzepabot.config import DB_PATH, tznow_dt, tznow_t
+from rzepabot.cache import IntLRU
+from rzepabot.config import (
+    DB_BUSY_TIMEOUT_MS,
+    DB_CACHE_SIZE_KB,
+    DB_COMMIT_WINDOW_MS,
+    DB_JOURNAL_MODE,
+    DB_MAX_BATCH,
+    DB_MMAP_SIZE,
+    DB_PATH,
+    DB_SYNCHRONOUS,
+    DB_WAIT_WARNING_MS,
+    DB_WORKERS,
+    IDENTITY_CACHE_SIZE,
+    STATIC_DB_PATH,
+    tznow_dt,
+    tznow_t,
+)
+from rzepabot.querylog import InstrumentedSqliteDatabase
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Schema the game data database is attached under.
+STATIC_SCHEMA = "static"
+
+db = InstrumentedSqliteDatabase(
+    DB_PATH,
+    # Lets ATTACH take URIs, see attach_static().
+    uri=True,
+    pragmas={
+        "foreign_keys": 1,
+        # A bare journal_mode would also apply to the attached databases.
+        "main.journal_mode": DB_JOURNAL_MODE,
+        "synchronous": DB_SYNCHRONOUS,
+        # Negative values are in KiB rather than pages.
+        "cache_size": -DB_CACHE_SIZE_KB,
+        "mmap_size": DB_MMAP_SIZE,
+        "temp_store": "memory",
+        "busy_timeout": DB_BUSY_TIMEOUT_MS,
+    },
+)
+
+
+# Guards swapping the game data database on a connection, so it's never
+# detached while another thread reads which file to attach.
+_static_lock = threading.Lock()
+
+
+def _attach_connection(uri: str):
+    """(Re-)attaches the game data database on this thread's connection."""
+    schemas = {row[1] for row in db.execute_sql("PRAGMA database_list")}
+    if STATIC_SCHEMA in schemas:
+        db.execute_sql(f'DETACH DATABASE "{STATIC_SCHEMA}"')
+    db.execute_sql(f'ATTACH DATABASE ? AS "{STATIC_SCHEMA}"', (uri,))
+
+
+def attach_static(writable: bool = False, path: str = STATIC_DB_PATH):
+    """
+    Attaches the game data database as the ``static`` schema.
+
+    By default it's opened read-only and immutable, so reading game data
+    never takes a lock or checks for changes; update_game_data.py replaces
+    the file instead of modifying it in place. Only the calling thread's
+    connection and connections opened later are affected.
+    """
+    uri = Path(path).resolve().as_uri()
+    uri += "?mode=rwc" if writable else "?mode=ro&immutable=1"
+    with _static_lock:
+        # Replaced in place rather than through db.detach() and db.attach(),
+        # so a connection opened meanwhile never misses the schema.
+        db._attached[STATIC_SCHEMA] = uri
+        if not db.is_closed():
+            _attach_connection(uri)
+
+
+attach_static()
+
+# Bumped by reload_static(); every thread's connection re-attaches the game
+# data database when it sees a newer generation.
+_static_generation = 0
+_static_state = threading.local()
+
+
+def reload_static():
+    """
+    Makes every connection re-attach the game data database before its next
+    transaction, picking up the file replaced by update_game_data.py.
+    Transactions already open keep reading the old file.
+    """
+    global _static_generation
+    _static_generation += 1
+
+
+def _refresh_static():
+    generation = _static_generation
+    if getattr(_static_state, "generation", 0) == generation:
+        return
+    if db.in_transaction():
+        return
+    with _static_lock:
+        _attach_connection(db._attached[STATIC_SCHEMA])
+    # Only once attached, so a failed attempt is retried next transaction.
+    _static_state.generation = generation
 
-db = SqliteDatabase(DB_PATH, pragmas={"foreign_keys": 1})
 
 dt_default = lambda: tznow_dt().to_datetime_string()
 
-t_default = tznow_t
+t_default = lambda: tznow_t().strftime("%H:%M:%S")
+
+
+def expires_in(**kwargs):
+    return lambda: tznow_dt().add(**kwargs).to_datetime_string()
+
+
+def expires_tomorrow():
+    return tznow_dt().add(days=1).start_of("day").to_datetime_string()
 
 
 @dataclass
@@ -252,6 +371,24 @@ class StalkPrice(BaseModel):
     price = IntegerField()
     user_time = TimeField(default=t_default)
     is_buy_price = BooleanField(default=False)
+    expires_at = DateTimeField(default=expires_in(months=1), index=True)
+
+    class Meta:
+        database = db
+        # A user's buy or sell prices since a given time.
+        indexes = ((("user", "is_buy_price", "timestamp"), False),)
+
+
+class StaticForeignKeyField(ForeignKeyField):
+    """
+    Foreign key to a game data model.
+
+    SQLite can't enforce constraints across attached databases, so no
+    REFERENCES clause is emitted for it.
+    """
+
+    def __init__(self, model, **kwargs):
+        super().__init__(model, _deferred=True, **kwargs)
 
 
 class Villager(BaseModel):
@@ -274,15 +411,23 @@ class Villager(BaseModel):
             f"{quote(self.name)})"
         )
 
+    class Meta:
+        database = db
+        schema = STATIC_SCHEMA
+
 
 class Residency(BaseModel):
     # Maps users to their villagers
-    villager = ForeignKeyField(Villager, backref="villagers")
+    villager = StaticForeignKeyField(Villager, backref="villagers")
     acprofile = ForeignKeyField(Island, backref="islands")
 
     class Meta:
         database = db
-        indexes = ((("villager", "acprofile"), True),)
+        indexes = (
+            (("villager", "acprofile"), True),
+            # Covers listing the residents of an island.
+            (("acprofile", "villager"), False),
+        )
 
 
 class Critter(BaseModel):
@@ -293,9 +438,13 @@ class Critter(BaseModel):
     location = CharField()
     is_fish = BooleanField()
 
+    class Meta:
+        database = db
+        schema = STATIC_SCHEMA
+
 
 class MuseumCritter(BaseModel):
-    critter = ForeignKeyField(Critter, backref="museums")
+    critter = StaticForeignKeyField(Critter, backref="museums")
     island = ForeignKeyField(Island, backref="critters")
 
 
@@ -303,6 +452,8 @@ class HotItem(BaseModel):
     user = ForeignKeyField(User, backref="hot_items")
     item = CharField()
     timestamp = DateTimeField(default=dt_default)
+    # Hot items are only valid for the day they were registered on.
+    expires_at = DateTimeField(default=expires_tomorrow, index=True)
 
 
 class DodoCode(BaseModel):
@@ -311,10 +462,24 @@ class DodoCode(BaseModel):
     code = CharField()
     timestamp = DateTimeField(default=dt_default)
     comment = TextField(null=True)
+    expires_at = DateTimeField(default=expires_in(days=1), index=True)
 
     class Meta:
         database = db
-        indexes = ((("user", "guild"), True),)
+        indexes = (
+            (("user", "guild"), True),
+            # A guild's open islands, in order of opening.
+            (("guild", "timestamp"), False),
+        )
+
+
+class TurnipForecast(BaseModel):
+    # Packed buy price, previous pattern and sell prices, see
+    # stalks.forecast_key(). Users with the same prices share a row.
+    key = BlobField(unique=True)
+    # Packed stalks.ForecastSummary.
+    forecast = BlobField()
+    expires_at = DateTimeField(default=expires_in(weeks=1), index=True)
 
 
 models = [
@@ -325,30 +490,428 @@ models = [
     Villager,
     Residency,
     Critter,
+    MuseumCritter,
     HotItem,
     DodoCode,
     Island,
+    TurnipForecast,
 ]
 
-db.create_tables(models)
 
+def transaction(database: SqliteDatabase):
+    """
+    Opens a transaction on the calling thread's connection.
 
-def get_user_and_guild(user_id, discord_guild, dbcontext):
-    user, _ = User.get_or_create(discord_id=user_id)
-    guild = None
-    if discord_guild is not None:
-        guild, _ = Guild.get_or_create(discord_id=discord_guild.id)
-        guild_membership = GuildMembership.get_or_create(
-            user=user, guild=guild
+    Connections are thread-local and stay open for the lifetime of the
+    thread, so the page cache, prepared statements and pragmas survive
+    between queries.
+    """
+    database.connect(reuse_if_open=True)
+    if database is db:
+        _refresh_static()
+    return database.atomic()
+
+
+@dataclass
+class PoolStats:
+    workers: int
+    queue_depth: int
+    running: int
+    completed: int
+    avg_wait_ms: float
+    max_wait_ms: float
+
+
+class DatabasePool:
+    """
+    Runs blocking database work on a bounded thread pool, so that slow
+    queries or lock waits never stall the event loop.
+
+    Every job runs in its own transaction, on the worker thread's persistent
+    connection.
+    """
+
+    def __init__(self, database: SqliteDatabase, workers: int):
+        self.database = database
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="rzepabot-db"
+        )
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._started = 0
+        self._completed = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    async def run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        with self._lock:
+            self._submitted += 1
+        # Executor threads don't inherit the caller's context by themselves.
+        context = contextvars.copy_context()
+        return await asyncio.get_event_loop().run_in_executor(
+            self._executor,
+            context.run,
+            self._call,
+            perf_counter(),
+            func,
+            args,
+            kwargs,
+        )
+
+    def _call(self, submitted, func, args, kwargs):
+        wait = perf_counter() - submitted
+        with self._lock:
+            self._started += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+            queue_depth = self._submitted - self._started
+        if wait * 1000 > DB_WAIT_WARNING_MS:
+            logger.warning(
+                "%s waited %.1f ms for a database worker (%d more queued)",
+                func.__qualname__,
+                wait * 1000,
+                queue_depth,
+            )
+        try:
+            with transaction(self.database):
+                return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._completed += 1
+
+    def stats(self) -> PoolStats:
+        with self._lock:
+            return PoolStats(
+                workers=self.workers,
+                queue_depth=self._submitted - self._started,
+                running=self._started - self._completed,
+                completed=self._completed,
+                avg_wait_ms=(
+                    self._total_wait / self._started * 1000
+                    if self._started
+                    else 0.0
+                ),
+                max_wait_ms=self._max_wait * 1000,
+            )
+
+
+class DatabaseWriter:
+    """
+    Funnels every write through a single coroutine.
+
+    Writes submitted within ``window_ms`` of each other (or while the
+    previous batch is still being committed) are executed in one
+    transaction, so a burst of commands pays for a single commit instead of
+    one each. Every write runs in its own savepoint: a write that raises is
+    rolled back on its own and the exception is re-raised in its caller,
+    without affecting the rest of the batch. Callers are resumed once the
+    whole batch has been committed.
+    """
+
+    def __init__(
+        self, database: SqliteDatabase, window_ms: float, max_batch: int
+    ):
+        self.database = database
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="rzepabot-db-writer"
+        )
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.writes = 0
+
+    async def submit(self, func: Callable[..., T], *args, **kwargs) -> T:
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.ensure_future(self._run())
+        future = asyncio.get_event_loop().create_future()
+        self._queue.put_nowait(
+            (contextvars.copy_context(), func, args, kwargs, future)
+        )
+        return await future
+
+    async def close(self):
+        """Waits for every queued write to commit and stops the writer."""
+        if self._task is None or self._task.done():
+            return
+        # Tells _run() to stop once nothing is left queued, including
+        # writes submitted while it drains the queue.
+        self._queue.put_nowait(None)
+        await self._task
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        stopping = False
+        while not (stopping and self._queue.empty()):
+            batch = [await self._queue.get()]
+            if self.window:
+                await asyncio.sleep(self.window)
+            while not self._queue.empty() and len(batch) < self.max_batch:
+                batch.append(self._queue.get_nowait())
+            if None in batch:
+                stopping = True
+                batch = [write for write in batch if write is not None]
+                if not batch:
+                    continue
+            results = await loop.run_in_executor(
+                self._executor, self._commit, batch
+            )
+            self.batches += 1
+            self.writes += len(batch)
+            for (*_, future), (ok, value) in zip(batch, results):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def _commit(self, batch) -> List[Tuple[bool, object]]:
+        results = []
+        try:
+            with transaction(self.database):
+                for context, func, args, kwargs, _ in batch:
+                    try:
+                        with self.database.atomic():
+                            results.append(
+                                (True, context.run(func, *args, **kwargs))
+                            )
+                    except Exception as e:
+                        results.append((False, e))
+        except Exception as e:
+            logger.exception("Failed to commit %d writes", len(batch))
+            return [(False, e)] * len(batch)
+        return results
+
+
+db_pool = DatabasePool(db, DB_WORKERS)
+db_writer = DatabaseWriter(db, DB_COMMIT_WINDOW_MS, DB_MAX_BATCH)
+
+
+class IdentityCache:
+    """
+    Maps Discord user and guild ids to their row ids, and remembers which
+    memberships are known to exist, so that resolving the author of a
+    command doesn't need any queries once they've been seen.
+
+    Only touched from the event loop.
+    """
+
+    def __init__(self, capacity: int):
+        self.users = IntLRU(capacity)
+        self.guilds = IntLRU(capacity)
+        # (user row id << 32 | guild row id) -> 1
+        self.memberships = IntLRU(capacity)
+
+    @staticmethod
+    def membership_key(user_pk: int, guild_pk: int) -> int:
+        return user_pk << 32 | guild_pk
+
+    def has_membership(self, user_pk: int, guild_pk: int) -> bool:
+        return (
+            self.memberships.get(self.membership_key(user_pk, guild_pk))
+            is not None
+        )
+
+    def add_membership(self, user_pk: int, guild_pk: int):
+        self.memberships.put(self.membership_key(user_pk, guild_pk), 1)
+
+    def forget_membership(self, user_pk: int, guild_pk: int):
+        self.memberships.pop(self.membership_key(user_pk, guild_pk))
+
+    def forget_guild(self, guild_id: int):
+        self.guilds.pop(guild_id)
+        # Row ids of deleted guilds can be reused, and memberships aren't
+        # indexed by guild, so drop them all. Guilds are removed rarely.
+        self.memberships.clear()
+
+
+identity_cache = IdentityCache(IDENTITY_CACHE_SIZE)
+
+
+def find_user_and_guild(user_id, guild_id):
+    user_pk = (
+        User.select(User.id).where(User.discord_id == user_id).scalar()
+    )
+    guild_pk = None
+    is_member = False
+    if guild_id is not None:
+        guild_pk = (
+            Guild.select(Guild.id).where(Guild.discord_id == guild_id).scalar()
+        )
+        if user_pk is not None and guild_pk is not None:
+            is_member = (
+                GuildMembership.select()
+                .where(
+                    GuildMembership.user == user_pk,
+                    GuildMembership.guild == guild_pk,
+                )
+                .exists()
+            )
+    return user_pk, guild_pk, is_member
+
+
+def create_user_and_guild(user_id, guild_id):
+    User.insert(discord_id=user_id).on_conflict_ignore().execute()
+    user_pk = User.select(User.id).where(User.discord_id == user_id).scalar()
+    guild_pk = None
+    if guild_id is not None:
+        Guild.insert(discord_id=guild_id).on_conflict_ignore().execute()
+        guild_pk = (
+            Guild.select(Guild.id).where(Guild.discord_id == guild_id).scalar()
         )
+        add_membership(user_pk, guild_pk)
+    return user_pk, guild_pk
+
+
+def add_membership(user_pk, guild_pk):
+    GuildMembership.insert(
+        user=user_pk, guild=guild_pk
+    ).on_conflict_ignore().execute()
+
+
+def _membership_written(user_pk, guild_pk, future):
+    if not future.cancelled() and future.exception() is not None:
+        identity_cache.forget_membership(user_pk, guild_pk)
+        logger.error(
+            "Failed to record membership of user %d in guild %d",
+            user_pk,
+            guild_pk,
+            exc_info=future.exception(),
+        )
+
+
+async def get_user_and_guild(user_id, discord_guild):
+    """
+    Returns the User and Guild rows for a Discord user and guild, creating
+    them (and the membership between them) through the writer if needed.
+
+    Row ids come from identity_cache whenever possible. A membership that
+    is new to the cache is recorded write-behind: the command doesn't wait
+    for it to be committed.
+    """
+    guild_id = discord_guild.id if discord_guild is not None else None
+    user_pk = identity_cache.users.get(user_id)
+    guild_pk = None
+    if guild_id is not None:
+        guild_pk = identity_cache.guilds.get(guild_id)
+    if user_pk is None or (guild_id is not None and guild_pk is None):
+        user_pk, guild_pk, is_member = await db_pool.run(
+            find_user_and_guild, user_id, guild_id
+        )
+        if user_pk is None or (guild_id is not None and not is_member):
+            user_pk, guild_pk = await db_writer.submit(
+                create_user_and_guild, user_id, guild_id
+            )
+        identity_cache.users.put(user_id, user_pk)
+        if guild_id is not None:
+            identity_cache.guilds.put(guild_id, guild_pk)
+            identity_cache.add_membership(user_pk, guild_pk)
+    elif guild_id is not None and not identity_cache.has_membership(
+        user_pk, guild_pk
+    ):
+        identity_cache.add_membership(user_pk, guild_pk)
+        asyncio.ensure_future(
+            db_writer.submit(add_membership, user_pk, guild_pk)
+        ).add_done_callback(
+            functools.partial(_membership_written, user_pk, guild_pk)
+        )
+    user = User(id=user_pk, discord_id=user_id)
+    guild = None
+    if guild_id is not None:
+        guild = Guild(id=guild_pk, discord_id=guild_id)
     return user, guild
 
 
-def cleanup():
-    now = tznow_dt()
-    day_ago = datetime.fromtimestamp(now.subtract(days=1).timestamp())
-    month_ago = datetime.fromtimestamp(now.subtract(months=1).timestamp())
-    with db:
-        StalkPrice.delete().where(StalkPrice.timestamp < month_ago).execute()
-        HotItem.delete().where(HotItem.timestamp < day_ago).execute()
-        DodoCode.delete().where(DodoCode.timestamp < day_ago).execute()
+# Stay well below SQLite's limit of 999 bound parameters per statement.
+CHUNK_SIZE = 500
+
+JoinedGuild = Table("joined_guild", ("discord_id",)).bind(db)
+
+
+def now_string():
+    return tznow_dt().to_datetime_string()
+
+
+EXPIRING_MODELS = (StalkPrice, HotItem, DodoCode, TurnipForecast)
+
+
+def delete_expired(model, now, limit):
+    expired = (
+        model.select(model.id)
+        .where(model.expires_at <= now)
+        .order_by(model.expires_at)
+        .limit(limit)
+    )
+    return model.delete().where(model.id.in_(expired)).execute()
+
+
+async def cleanup():
+    """
+    Deletes expired rows, CHUNK_SIZE at a time.
+
+    Every chunk is a separate write, so other writes get to go in between
+    them. Reads filter out expired rows on their own, so when this runs only
+    affects the size of the database.
+    """
+    now = now_string()
+    for model in EXPIRING_MODELS:
+        while (
+            await db_writer.submit(delete_expired, model, now, CHUNK_SIZE)
+            == CHUNK_SIZE
+        ):
+            pass
+
+
+def add_guild(guild_id):
+    Guild.insert(discord_id=guild_id).on_conflict_ignore().execute()
+    return Guild.select(Guild.id).where(Guild.discord_id == guild_id).scalar()
+
+
+def delete_guilds(guild_ids):
+    """
+    Deletes the given guilds, along with their memberships and dodocodes.
+    """
+    guild_ids = list(guild_ids)
+    for i in range(0, len(guild_ids), CHUNK_SIZE):
+        chunk = guild_ids[i : i + CHUNK_SIZE]
+        guilds = Guild.select(Guild.id).where(Guild.discord_id.in_(chunk))
+        GuildMembership.delete().where(
+            GuildMembership.guild.in_(guilds)
+        ).execute()
+        DodoCode.delete().where(DodoCode.guild.in_(guilds)).execute()
+        Guild.delete().where(Guild.discord_id.in_(chunk)).execute()
+
+
+def prune_guilds(joined_guild_ids):
+    """
+    Deletes every guild the bot is no longer a member of. Returns the
+    Discord ids of the deleted guilds.
+
+    The joined guilds are loaded into a temporary table, so finding the
+    stale ones is a single query regardless of how many guilds there are.
+    """
+    db.execute_sql(
+        "CREATE TEMP TABLE IF NOT EXISTS joined_guild "
+        "(discord_id INTEGER PRIMARY KEY)"
+    )
+    try:
+        joined_guild_ids = list(joined_guild_ids)
+        for i in range(0, len(joined_guild_ids), CHUNK_SIZE):
+            JoinedGuild.insert(
+                [(g,) for g in joined_guild_ids[i : i + CHUNK_SIZE]],
+                columns=[JoinedGuild.discord_id],
+            ).on_conflict_ignore().execute()
+        stale = [
+            g
+            for g, in Guild.select(Guild.discord_id)
+            .where(Guild.discord_id.not_in(JoinedGuild.select()))
+            .tuples()
+        ]
+    finally:
+        db.execute_sql("DROP TABLE temp.joined_guild")
+    delete_guilds(stale)
+    return stale
@@ -0,0 +1,34 @@
+# Copyright (c) 2020 Slavfox
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+from __future__ import annotations
+
+from discord.ext import commands
+
+from rzepabot.exceptions import RzepaException
+
+
+class Admin(commands.Cog, command_attrs={"hidden": True}):
+    """
+    Komendy dla właściciela bota.
+    """
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+
+    @commands.command(aliases=["przeladuj"])
+    @commands.is_owner()
+    async def przeładuj(self, ctx: commands.Context):
+        """
+        Wczytuje nowe dane gry (po `update_game_data.py`) bez restartu bota.
+        """
+        try:
+            data = await self.bot.reload_game_data()
+        except FileNotFoundError as e:
+            raise RzepaException(f"Brak pliku z danymi gry: {e}.")
+        return await ctx.send(
+            f"♻️ Wczytano dane gry: {len(data.villagers)} zwierzaków, "
+            f"{len(data.critters)} stworzeń."
+        )
@@ -12,7 +12,15 @@ from peewee import JOIN
 from pendulum import instance, timezone
 
 from rzepabot.exceptions import RzepaException
-from rzepabot.persistence import DodoCode, Island, User, db, get_user_and_guild
+from rzepabot.persistence import (
+    DodoCode,
+    Island,
+    User,
+    db_pool,
+    db_writer,
+    get_user_and_guild,
+    now_string,
+)
 
 VALID_DODOCODE_CHARS = "1234567890QWERTYUPASDFGHJKLXCVBNM"
 
@@ -32,6 +40,37 @@ def validate_dodocode(dodocode: str):
     return code
 
 
+def register_dodocode(user, guild, code, comment):
+    # Clean up old dodocodes
+    DodoCode.delete().where(
+        DodoCode.user == user, DodoCode.guild_id == guild.id
+    ).execute()
+    DodoCode(user=user, guild=guild, code=code, comment=comment).save()
+    return user.island.first()
+
+
+def remove_dodocode(user):
+    code = DodoCode.get_or_none(
+        DodoCode.user == user, DodoCode.expires_at > now_string()
+    )
+    if not code:
+        return None, None
+    code.delete_instance()
+    return code, user.island.first()
+
+
+def get_open_islands(guild):
+    codes = (
+        DodoCode.select(DodoCode, User, Island)
+        .join(User)
+        .join(Island, JOIN.LEFT_OUTER)
+        .where(DodoCode.guild == guild, DodoCode.expires_at > now_string())
+        .order_by(DodoCode.timestamp)
+        .objects()
+    )
+    return [(code, code.user.island.first()) for code in codes]
+
+
 class Dodokod(commands.Cog):
     """Komendy dotyczące otwierania wyspy dla gości."""
 
@@ -57,16 +96,10 @@ class Dodokod(commands.Cog):
         if len(komentarz) > 255:
             raise RzepaException(f"Ten komentarz jest zbyt długi!")
 
-        with db:
-            user, guild = get_user_and_guild(ctx.author.id, ctx.guild, db)
-            # Clean up old dodocodes
-            DodoCode.delete().where(
-                DodoCode.user == user, DodoCode.guild_id == guild.id
-            ).execute()
-            DodoCode(
-                user=user, guild=guild, code=code, comment=komentarz
-            ).save()
-        island = user.island.first()
+        user, guild = await get_user_and_guild(ctx.author.id, ctx.guild)
+        island = await db_writer.submit(
+            register_dodocode, user, guild, code, komentarz
+        )
         if island:
             island_name = island.island_name
         else:
@@ -85,22 +118,19 @@ class Dodokod(commands.Cog):
         """
         Zamyka wcześniej otwartą wyspę.
         """
-        with db:
-            user, _ = get_user_and_guild(ctx.author.id, ctx.guild, db)
-            code = DodoCode.get_or_none(DodoCode.user == user)
-            if not code:
-                return await ctx.send(
-                    f"{ctx.author.mention}, nie masz obecnie otwartej wyspy."
-                )
-            code.delete_instance()
-            island = user.island.first()
-            if island:
-                island_name = island.island_name
-            else:
-                island_name = f"użytkownika {ctx.author.mention}"
+        user, _ = await get_user_and_guild(ctx.author.id, ctx.guild)
+        code, island = await db_writer.submit(remove_dodocode, user)
+        if not code:
             return await ctx.send(
-                f"🛬 Zamknięto wyspę {island_name} z kodem" f" {code.code}."
+                f"{ctx.author.mention}, nie masz obecnie otwartej wyspy."
             )
+        if island:
+            island_name = island.island_name
+        else:
+            island_name = f"użytkownika {ctx.author.mention}"
+        return await ctx.send(
+            f"🛬 Zamknięto wyspę {island_name} z kodem" f" {code.code}."
+        )
 
     @commands.command(aliases=["otwarte"])
     @commands.check(commands.guild_only())
@@ -108,49 +138,40 @@ class Dodokod(commands.Cog):
         """
         Wypisuje informacje o otwartych wyspach na obecnym serwerze.
         """
-        with db:
-            user, guild = get_user_and_guild(ctx.author.id, ctx.guild, db)
-            codes = (
-                DodoCode.select(DodoCode, User, Island)
-                .join(User)
-                .join(Island, JOIN.LEFT_OUTER)
-                .where(DodoCode.guild == guild)
-                .objects()
-            )
-            lines = []
-            for i, code in enumerate(codes, 1):
-                if (island := code.user.island.first()) and island.island_name:
-                    island_identifier = island.island_name
-                else:
-                    d_id = code.user.discord_id
-                    user = ctx.guild.get_member(d_id)
-                    island_identifier = (
-                        f"Wyspa użytkownika **" f"{user.display_name}**"
-                    )
-                opened_at = instance(
-                    code.timestamp, tz=timezone("Europe/Warsaw")
-                ).diff_for_humans(locale="pl")
-                comment = ""
-                if code.comment:
-                    comment = f', komentarz "{code.comment}"'
-                lines.append(
-                    f"{i}. `{code.code}`: {island_identifier} "
-                    f"(otwarto **{opened_at}**{comment})\n"
+        _, guild = await get_user_and_guild(ctx.author.id, ctx.guild)
+        codes = await db_pool.run(get_open_islands, guild)
+        lines = []
+        for i, (code, island) in enumerate(codes, 1):
+            if island and island.island_name:
+                island_identifier = island.island_name
+            else:
+                d_id = code.user.discord_id
+                user = ctx.guild.get_member(d_id)
+                island_identifier = (
+                    f"Wyspa użytkownika **" f"{user.display_name}**"
                 )
+            opened_at = instance(
+                code.timestamp, tz=timezone("Europe/Warsaw")
+            ).diff_for_humans(locale="pl")
+            comment = ""
+            if code.comment:
+                comment = f', komentarz "{code.comment}"'
+            lines.append(
+                f"{i}. `{code.code}`: {island_identifier} "
+                f"(otwarto **{opened_at}**{comment})\n"
+            )
 
-            if not lines:
-                return await ctx.send(
-                    ":no_entry: Na tym serwerze nie ma obecnie "
-                    "otwartych wysp."
-                )
-            l = 0
-            s = "🛫 **Otwarte wyspy** 🛬\n\n"
-            messages = []
-            for line in lines:
-                if len(s + line) > 1998:
-                    messages.append(s)
-                    s = ""
-                s += line
-            messages.append(s)
-            for message in messages:
-                await ctx.send(message)
+        if not lines:
+            return await ctx.send(
+                ":no_entry: Na tym serwerze nie ma obecnie otwartych wysp."
+            )
+        s = "🛫 **Otwarte wyspy** 🛬\n\n"
+        messages = []
+        for line in lines:
+            if len(s + line) > 1998:
+                messages.append(s)
+                s = ""
+            s += line
+        messages.append(s)
+        for message in messages:
+            await ctx.send(message)
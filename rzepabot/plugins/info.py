@@ -12,7 +12,9 @@ import pendulum
 from discord import Embed, Emoji, File
 from discord.ext import commands
 
-from rzepabot.config import depoliszifaj, RZEPABOT_ROOT
+from rzepabot import cards, gamedata
+from rzepabot.cache import HourlyCache
+from rzepabot.config import depoliszifaj
 from rzepabot.exceptions import RzepaException
 from rzepabot.plugins.dodokod import Dodokod
 from rzepabot.persistence import (
@@ -23,8 +25,7 @@ from rzepabot.persistence import (
     PERSONALITY_GENDER,
     REVERSE_SPECIES,
     Villager,
-    db,
-    Critter,
+    db_pool,
 )
 
 KNIFE_EMOJI = 690576498985271317
@@ -58,6 +59,14 @@ rev_months = {
     11: "grudzień",
 }
 
+MONTH_ABBREVIATIONS = [
+    pendulum.datetime(2020, month, 1).format("MMM") for month in range(1, 13)
+]
+# "do końca stycznia"
+MONTH_GENITIVES = [
+    pendulum.datetime(2020, month, 1).format("MMMM") for month in range(1, 13)
+]
+
 in_month = {
     1: "styczniu",
     2: "lutym",
@@ -74,6 +83,22 @@ in_month = {
 }
 
 
+# Discord embeds can't have more than 25 fields, one per day.
+UPCOMING_BIRTHDAYS_MAX_DAYS = 25
+
+
+def format_day(month, day):
+    # A leap year, so that the 29th of February can be formatted too.
+    return pendulum.date(2020, month, day).format("D MMMM")
+
+
+def did_you_mean(tekst):
+    suggestions = gamedata.villagers.suggest(tekst)
+    if not suggestions:
+        return ""
+    return f" Czy chodziło ci o: {', '.join(v.name for v in suggestions)}?"
+
+
 def villager_profile(title, villager: Villager):
     if villager.name == "Pietro":
         species = "🤡 Zwiastun apokalipsy"
@@ -105,9 +130,9 @@ def villager_profile(title, villager: Villager):
         )
         .add_field(
             name="Urodziny",
-            value=pendulum.now()
-            .replace(month=villager.birthday_month, day=villager.birthday_day)
-            .format("D MMMM"),
+            value=format_day(
+                villager.birthday_month, villager.birthday_day
+            ),
         )
     )
     return embed
@@ -134,11 +159,8 @@ def month_mask_to_printable(mask):
     if ranges[0][0] == 1 and ranges[-1][1] == 12:
         ranges[0] = (ranges[-1][0], ranges[0][1])
         ranges.pop()
-    now = pendulum.now()
     printable_ranges = [
-        now.replace(month=r[0]).format("MMM")
-        + "-"
-        + now.replace(month=r[1]).format("MMM")
+        MONTH_ABBREVIATIONS[r[0] - 1] + "-" + MONTH_ABBREVIATIONS[r[1] - 1]
         for r in ranges
     ]
     return ", ".join(printable_ranges)
@@ -170,113 +192,33 @@ def hour_mask_to_printable(mask):
     return ", ".join(printable_ranges)
 
 
-def get_current_critters(
-    is_fish=True, include_time=False, order_by=Critter.price.desc()
-):
-    now = pendulum.now()
-    critters = []
-
-    now_month = 2 ** (now.month - 1)
-    now_time = 2 ** now.hour
-    with db:
-        for critter in (
-            Critter.select()
-            .where(
-                Critter.is_fish == is_fish,
-                Critter.month_mask.bin_and(now_month) > 0,
-                Critter.time_mask.bin_and(now_time) > 0,
-            )
-            .order_by(order_by)
-        ):
-            c = [critter.name, critter.price, critter.location]
-            if include_time:
-                c += [
-                    hour_mask_to_printable(critter.time_mask),
-                    month_mask_to_printable(critter.month_mask),
-                ]
-            critters.append(c)
-    return critters
-
-
-def get_critters_for_month(
-    month, is_fish=True, include_time=True, order_by=Critter.price.desc()
-):
-    critters = []
-    with db:
-        for critter in (
-            Critter.select()
-            .where(
-                Critter.is_fish == is_fish,
-                Critter.month_mask.bin_and(2 ** month) > 0,
-            )
-            .order_by(order_by)
-        ):
-            c = [critter.name, critter.price, critter.location]
-            if include_time:
-                c += [
-                    hour_mask_to_printable(critter.time_mask),
-                    month_mask_to_printable(critter.month_mask),
-                ]
-            critters.append(c)
-    return critters
-
-
-def get_leaving_critters_for_month(
-    month, is_fish=True, include_time=True, order_by=Critter.price.desc()
-):
-    critters = []
-    if month == 11:
-        next_mask = 1
-    else:
-        next_mask = 2 ** (month + 1)
-    month_mask = 2 ** month
-    with db:
-        for critter in (
-            Critter.select()
-            .where(
-                Critter.is_fish == is_fish,
-                Critter.month_mask.bin_and(month_mask | next_mask)
-                == month_mask,
-            )
-            .order_by(order_by)
-        ):
-            c = [critter.name, critter.price, critter.location]
-            if include_time:
-                c += [
-                    hour_mask_to_printable(critter.time_mask),
-                    month_mask_to_printable(critter.month_mask),
-                ]
-            critters.append(c)
-    return critters
-
-
-def get_new_critters_for_month(
-    month, is_fish=True, include_time=True, order_by=Critter.price.desc()
-):
-    critters = []
-    if month == 0:
-        previous_mask = 11
-    else:
-        previous_mask = 2 ** (month - 1)
-    month_mask = 2 ** month
-    with db:
-        for critter in (
-            Critter.select()
-            .where(
-                Critter.is_fish == is_fish,
-                Critter.month_mask.bin_and(month_mask | previous_mask)
-                == month_mask,
-            )
-            .order_by(order_by)
-        ):
-            c = [critter.name, critter.price, critter.location]
-            if include_time:
-                c += [
-                    hour_mask_to_printable(critter.time_mask),
-                    month_mask_to_printable(critter.month_mask),
-                ]
-            critters.append(c)
-    return critters
+def critter_lines(critters, include_time):
+    lines = []
+    for critter in critters:
+        c = [critter.name, critter.price, critter.location]
+        if include_time:
+            c += [
+                hour_mask_to_printable(critter.time_mask),
+                month_mask_to_printable(critter.month_mask),
+            ]
+        lines.append(c)
+    return lines
+
+
+def get_critters_for_month(month, is_fish=True, include_time=True):
+    return critter_lines(
+        gamedata.critters.available(is_fish, month), include_time
+    )
+
+
+def get_leaving_critters_for_month(month, is_fish=True, include_time=True):
+    return critter_lines(
+        gamedata.critters.leaving(is_fish, month), include_time
+    )
+
+
+def get_new_critters_for_month(month, is_fish=True, include_time=True):
+    return critter_lines(gamedata.critters.new(is_fish, month), include_time)
 
 
 def format_critters(heading, critters, print_time=False):
@@ -295,6 +237,64 @@ def format_critters(heading, critters, print_time=False):
     return messages
 
 
+CRITTER_HEADINGS = {
+    (True, "month"): "🎣 **Ryby na miesiąc {month}** 🎣\n\n",
+    (True, "new"): "🎣 **Nowe ryby na miesiąc {month}** 🎣\n\n",
+    (True, "leaving"): (
+        "🎣 **Ryby dostępne tylko do końca {genitive}** 🎣\n\n"
+    ),
+    (True, "now"): "🎣 **Obecnie występujące ryby** 🎣\n\n",
+    (False, "month"): "🎷🐛 **Insekty na miesiąc {month}** 🎷🐛\n\n",
+    (False, "new"): "🎷🐛 **Nowe insekty na miesiąc {month}** 🎷🐛\n\n",
+    (False, "leaving"): (
+        "🎷🐛 **Insekty dostępne tylko do końca {genitive}** 🎷🐛\n\n"
+    ),
+    (False, "now"): "🎷🐛 **Obecnie występujące insekty** 🎷🐛\n\n",
+}
+
+# Listings only change with the hour, so they're rendered once per hour.
+critter_page_cache = HourlyCache()
+
+
+def render_critter_pages(is_fish, mode, month, hour=None):
+    if mode == "now":
+        critters = critter_lines(
+            gamedata.critters.available(is_fish, month, hour), False
+        )
+    else:
+        critters = {
+            "month": get_critters_for_month,
+            "new": get_new_critters_for_month,
+            "leaving": get_leaving_critters_for_month,
+        }[mode](month, is_fish=is_fish)
+    heading = CRITTER_HEADINGS[is_fish, mode].format(
+        month=rev_months[month], genitive=MONTH_GENITIVES[month]
+    )
+    return format_critters(heading, critters, print_time=mode != "now")
+
+
+def get_critter_pages(is_fish, mode, month=None):
+    """
+    Returns the messages listing critters of the given kind.
+
+    ``mode`` is one of "month", "new", "leaving" (critters available in,
+    new in, or leaving after ``month``, by default the current one) and
+    "now".
+    """
+    hour = None
+    if mode == "now" or month is None:
+        now = pendulum.now()
+        month = now.month - 1
+        if mode == "now":
+            hour = now.hour
+    # Keyed by the index too, so pages rendered for a command still running
+    # on the previous snapshot don't stick around after gamedata.reload().
+    return critter_page_cache.get(
+        (gamedata.critters, is_fish, mode, month, hour),
+        lambda: render_critter_pages(is_fish, mode, month, hour),
+    )
+
+
 class Info(commands.Cog):
     """
     Komendy do szukania informacji na temat Animal Crossing: New Horizons.
@@ -346,21 +346,15 @@ class Info(commands.Cog):
         """
         Wypisuje dostępne w danym (domyślnie obecnym) miesiącu ryby.
         """
-        if not miesiac:
-            m_no = pendulum.now().month - 1
-            miesiac = rev_months[m_no]
-        else:
+        m_no = None
+        if miesiac:
             try:
                 m_no = MONTHS[depoliszifaj(miesiac.lower())]
             except KeyError:
                 raise RzepaException(
                     f"{miesiac} nie jest poprawną nazwą " f"miesiąca."
                 )
-        for message in format_critters(
-            f"🎣 **Ryby na miesiąc {miesiac.lower()}** 🎣\n\n",
-            get_critters_for_month(m_no, is_fish=True),
-            print_time=True,
-        ):
+        for message in get_critter_pages(True, "month", m_no):
             await ctx.send(message)
 
     @ryby_.command(aliases=["nowe", "n"])
@@ -368,21 +362,15 @@ class Info(commands.Cog):
         """
         Wypisuje nowe w danym (domyślnie obecnym) miesiącu ryby.
         """
-        if not miesiac:
-            m_no = pendulum.now().month - 1
-            miesiac = rev_months[m_no]
-        else:
+        m_no = None
+        if miesiac:
             try:
                 m_no = MONTHS[depoliszifaj(miesiac.lower())]
             except KeyError:
                 raise RzepaException(
                     f"{miesiac} nie jest poprawną nazwą miesiąca."
                 )
-        for message in format_critters(
-            f"🎣 **Nowe ryby na miesiąc {miesiac.lower()}** 🎣\n\n",
-            get_new_critters_for_month(m_no, is_fish=True),
-            print_time=True,
-        ):
+        for message in get_critter_pages(True, "new", m_no):
             await ctx.send(message)
 
     @ryby_.command(aliases=["koniec", "k"])
@@ -390,21 +378,15 @@ class Info(commands.Cog):
         """
         Ryby dostępne tylko do końca danego (domyślnie obecnego) miesiąca.
         """
-        if not miesiac:
-            m_no = pendulum.now().month - 1
-        else:
+        m_no = None
+        if miesiac:
             try:
                 m_no = MONTHS[depoliszifaj(miesiac.lower())]
             except KeyError:
                 raise RzepaException(
                     f"{miesiac} nie jest poprawną nazwą miesiąca."
                 )
-        mname = pendulum.now().replace(month=m_no + 1).format("MMMM")
-        for message in format_critters(
-            f"🎣 **Ryby dostępne tylko do końca {mname}** 🎣\n\n",
-            get_leaving_critters_for_month(m_no, is_fish=True),
-            print_time=True,
-        ):
+        for message in get_critter_pages(True, "leaving", m_no):
             await ctx.send(message)
 
     @ryby_.command(aliases=["teraz", "t"])
@@ -412,10 +394,7 @@ class Info(commands.Cog):
         """
         Wypisuje dostępne w tej chwili do złowienia ryby.
         """
-        for message in format_critters(
-            "🎣 **Obecnie występujące ryby** 🎣\n\n",
-            get_current_critters(is_fish=True),
-        ):
+        for message in get_critter_pages(True, "now"):
             await ctx.send(message)
 
     @commands.group(aliases=["robaki", "insekty", "i"])
@@ -441,22 +420,15 @@ class Info(commands.Cog):
         """
         Wypisuje dostępne w danym (domyślnie obecnym) miesiącu insekty.
         """
-        if not miesiac:
-            now = pendulum.now()
-            m_no = now.month - 1
-            miesiac = rev_months[m_no]
-        else:
+        m_no = None
+        if miesiac:
             try:
                 m_no = MONTHS[depoliszifaj(miesiac.lower())]
             except KeyError:
                 raise RzepaException(
                     f"{miesiac} nie jest poprawną nazwą miesiąca."
                 )
-        for message in format_critters(
-            f"🎷🐛 **Insekty na miesiąc {miesiac.lower()}** 🎷🐛\n\n",
-            get_critters_for_month(m_no, is_fish=False),
-            print_time=True,
-        ):
+        for message in get_critter_pages(False, "month", m_no):
             await ctx.send(message)
 
     @insekty_.command(aliases=["nowe", "n"])
@@ -466,21 +438,15 @@ class Info(commands.Cog):
         """
         Wypisuje nowe w danym (domyślnie obecnym) miesiącu insekty.
         """
-        if not miesiac:
-            m_no = pendulum.now().month - 1
-            miesiac = rev_months[m_no]
-        else:
+        m_no = None
+        if miesiac:
             try:
                 m_no = MONTHS[depoliszifaj(miesiac.lower())]
             except KeyError:
                 raise RzepaException(
                     f"{miesiac} nie jest poprawną nazwą miesiąca."
                 )
-        for message in format_critters(
-            f"🎷🐛 **Nowe insekty na miesiąc {miesiac.lower()}** 🎷🐛\n\n",
-            get_new_critters_for_month(m_no, is_fish=False),
-            print_time=True,
-        ):
+        for message in get_critter_pages(False, "new", m_no):
             await ctx.send(message)
 
     @insekty_.command(aliases=["koniec", "k"])
@@ -490,21 +456,15 @@ class Info(commands.Cog):
         """
         Insekty dostępne tylko do końca danego (domyślnie obecnego) miesiąca.
         """
-        if not miesiac:
-            m_no = pendulum.now().month - 1
-        else:
+        m_no = None
+        if miesiac:
             try:
                 m_no = MONTHS[depoliszifaj(miesiac.lower())]
             except KeyError:
                 raise RzepaException(
                     f"{miesiac} nie jest poprawną nazwą miesiąca."
                 )
-        mname = pendulum.now().replace(month=m_no + 1).format("MMMM")
-        for message in format_critters(
-            f"🎷🐛 **Insekty dostępne tylko do końca {mname}** 🎷🐛\n\n",
-            get_leaving_critters_for_month(m_no, is_fish=False),
-            print_time=True,
-        ):
+        for message in get_critter_pages(False, "leaving", m_no):
             await ctx.send(message)
 
     @insekty_.command(aliases=["teraz", "t"])
@@ -512,10 +472,7 @@ class Info(commands.Cog):
         """
         Wypisuje dostępne w tej chwili do złapania insekty.
         """
-        for message in format_critters(
-            "🎷🐛 **Obecnie występujące insekty** 🎷🐛\n\n",
-            get_current_critters(is_fish=False),
-        ):
+        for message in get_critter_pages(False, "now"):
             await ctx.send(message)
 
     @commands.group(aliases=["zwierzaki", "zwierzak", "zwierz", "z"])
@@ -551,16 +508,14 @@ class Info(commands.Cog):
                 f"Horizons. Podaj jedną z: {', '.join(options[:-1])}, lub"
                 f"{options[-1]}."
             )
-        with db:
-            villagers = {}
-            for villager in (
-                Villager.select()
-                .where(Villager.personality == personality)
-                .order_by(Villager.species, Villager.name)
-            ):
-                villagers.setdefault(villager.species, []).append(
-                    villager.name
-                )
+        villagers = {}
+        for villager in await db_pool.run(
+            list,
+            Villager.select()
+            .where(Villager.personality == personality)
+            .order_by(Villager.species, Villager.name),
+        ):
+            villagers.setdefault(villager.species, []).append(villager.name)
         embed = Embed(
             title=f':smiley_cat: Zwierzaki o osobowości _"{personality}"_ '
             f":smiley_cat:"
@@ -607,16 +562,16 @@ class Info(commands.Cog):
                 f"lub"
                 f"{options[-1]}."
             )
-        with db:
-            villagers = {}
-            for villager in (
-                Villager.select()
-                .where(Villager.species == species)
-                .order_by(Villager.personality, Villager.name)
-            ):
-                villagers.setdefault(villager.personality, []).append(
-                    villager.name
-                )
+        villagers = {}
+        for villager in await db_pool.run(
+            list,
+            Villager.select()
+            .where(Villager.species == species)
+            .order_by(Villager.personality, Villager.name),
+        ):
+            villagers.setdefault(villager.personality, []).append(
+                villager.name
+            )
         embed = Embed(
             title=f'{SPECIES_EMOJI[species]} Zwierzaki z gatunku _"{species}"_ '
             f"{SPECIES_EMOJI[species]}",
@@ -637,25 +592,22 @@ class Info(commands.Cog):
     async def find(self, ctx: commands.Context, *, tekst: str):
         """Znajduje zwierzaki których imię zawiera podany tekst."""
         tekst = tekst.lower().strip()
-        with db:
-            villagers = []
-            for villager in Villager.select().where(
-                Villager.name ** f"%{tekst}%"
-            ):
-                villagers.append(villager.name)
+        villagers = gamedata.villagers.search(tekst)
         if not villagers:
             return await ctx.send(
                 f":crying_cat_face: "
                 f'Nie znaleziono zwierzaków których imię zawiera "{tekst}".'
+                f"{did_you_mean(tekst)}"
             )
         if len(villagers) > 1:
             return await ctx.send(
                 f":smiley_cat: "
                 f'**Zwierzaki których imię zawiera _"{tekst}"_** '
                 f":smiley_cat:\n\n"
-                f"{', '.join(villagers)}"
+                f"{', '.join(v.name for v in villagers)}"
             )
         else:
+            villager = villagers[0]
             emoji = SPECIES_EMOJI.get(villager.species, "")
             return await ctx.send(
                 embed=villager_profile(
@@ -667,12 +619,12 @@ class Info(commands.Cog):
     async def profile(self, ctx: commands.Context, *, tekst: str):
         """Wyświetla informacje o danym zwierzaku."""
         tekst = tekst.lower().strip()
-        with db:
-            villager = Villager.get_or_none(Villager.name ** tekst)
+        villager = gamedata.villagers.get(tekst)
         if not villager:
             return await ctx.send(
                 f":crying_cat_face: "
                 f'Nie znaleziono zwierzaka o imieniu "{tekst.capitalize()}".'
+                f"{did_you_mean(tekst)}"
             )
         emoji = SPECIES_EMOJI.get(villager.species, "")
         if villager.name == "Pietro":
@@ -694,12 +646,12 @@ class Info(commands.Cog):
     async def card(self, ctx: commands.Context, *, tekst: str):
         """Wyświetla informacje o danym zwierzaku, plus prezent."""
         tekst = tekst.lower().strip()
-        with db:
-            villager = Villager.get_or_none(Villager.name ** tekst)
+        villager = gamedata.villagers.get(tekst)
         if not villager:
             return await ctx.send(
                 f":crying_cat_face: "
                 f'Nie znaleziono zwierzaka o imieniu "{tekst.capitalize()}".'
+                f"{did_you_mean(tekst)}"
             )
         emoji = SPECIES_EMOJI.get(villager.species, "")
         if villager.name == "Pietro":
@@ -712,15 +664,9 @@ class Info(commands.Cog):
                     ),
                 )
         extra_args = {}
-        path = (
-            RZEPABOT_ROOT
-            / "rzepabot"
-            / "data"
-            / "cards"
-            / f"{villager.name}.bin"
-        )
-        if path.is_file():
-            extra_args["file"] = File(path.absolute())
+        card = cards.archive.file(villager.name)
+        if card is not None:
+            extra_args["file"] = File(card, filename=f"{villager.name}.bin")
         return await ctx.send(
             embed=villager_profile(
                 f"{emoji} **{villager.name}** {emoji}", villager
@@ -756,19 +702,10 @@ class Info(commands.Cog):
                 raise RzepaException(
                     f"{miesiac} nie jest poprawnym numerem miesiąca."
                 )
+            villagers = gamedata.villagers.birthdays.in_month(miesiac)
         else:
-            human_date = now.replace(month=miesiac, day=dzien).format("D MMMM")
-
-        with db:
-            filters = [Villager.birthday_month == miesiac]
-            if dzien is not None:
-                filters.append(Villager.birthday_day == dzien)
-            villagers = list(
-                Villager.select()
-                .where(*filters)
-                .order_by(Villager.birthday_month, Villager.birthday_day)
-                .objects()
-            )
+            human_date = format_day(miesiac, dzien)
+            villagers = gamedata.villagers.birthdays.on(miesiac, dzien)
         if not villagers:
             return await ctx.send(
                 f":calendar: "
@@ -792,15 +729,43 @@ class Info(commands.Cog):
             for v in villagers:
                 vdays.setdefault(v.birthday_day, []).append(v)
             for day, vs in vdays.items():
-                v = ", ".join(
-                    [
-                        f"[{v.name}](https://animalcrossing.fandom.com/wiki/"
-                        f"{quote(v.name)})"
-                        for v in vs
-                    ]
-                )
                 embed.add_field(
-                    name=now.replace(month=miesiac, day=day).format("D MMMM"),
-                    value=v,
+                    name=format_day(miesiac, day),
+                    value=", ".join(v.link for v in vs),
                 )
             return await ctx.send(embed=embed)
+
+    @zwierzaki_.command(aliases=["nadchodzące", "nadchodzace", "n"])
+    async def upcoming_birthdays(
+        self, ctx: commands.Context, dni: Optional[int] = 7
+    ):
+        """
+        Wyświetla zwierzaki obchodzące urodziny w ciągu najbliższych dni.
+
+        Wywołane jako `$zwierzaki nadchodzące 14` wyświetla zwierzaki
+        obchodzące urodziny w ciągu najbliższych 14 dni (domyślnie 7).
+        """
+        if not 1 <= dni <= UPCOMING_BIRTHDAYS_MAX_DAYS:
+            raise RzepaException(
+                f"Liczba dni musi być pomiędzy 1 a "
+                f"{UPCOMING_BIRTHDAYS_MAX_DAYS}."
+            )
+        upcoming = gamedata.villagers.birthdays.upcoming(
+            pendulum.now().date(), dni
+        )
+        if not upcoming:
+            return await ctx.send(
+                f":calendar: Żaden zwierzak nie obchodzi urodzin w ciągu "
+                f"najbliższych {dni} dni."
+            )
+        embed = Embed(
+            title=f":calendar: Urodziny w ciągu najbliższych {dni} dni "
+            f":calendar:",
+            color=0x8AD88A,
+        )
+        for day, vs in upcoming:
+            embed.add_field(
+                name=format_day(day.month, day.day),
+                value=", ".join(v.link for v in vs),
+            )
+        return await ctx.send(embed=embed)
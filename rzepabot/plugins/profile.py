@@ -14,18 +14,20 @@ from discord.ext.commands.converter import MemberConverter
 from rzepabot.plugins.info import villager_profile
 from urllib.parse import quote, urlencode
 
+from rzepabot import gamedata
 from rzepabot.exceptions import RzepaException
 from rzepabot.persistence import (
     DodoCode,
     Island,
     User,
     db,
+    db_pool,
+    db_writer,
     get_user_and_guild,
+    now_string,
     Residency,
-    Villager,
     FRUIT,
     HotItem,
-    Guild,
     GuildMembership,
     tznow_dt,
 )
@@ -45,8 +47,22 @@ def format_fc(friend_code: str) -> str:
     return f"SW-{friend_code[:4]}-{friend_code[4:8]}-{friend_code[8:]}"
 
 
+def get_residents(island: Island):
+    villagers = [
+        gamedata.villagers.by_id(villager_id)
+        for villager_id, in Residency.select(Residency.villager)
+        .where(Residency.acprofile == island)
+        .tuples()
+    ]
+    return sorted(v.name for v in villagers if v is not None)
+
+
 def format_profile(
-    island: Island, user: Member, dodocode: str = None, item: str = None
+    island: Island,
+    user: Member,
+    residents=(),
+    dodocode: str = None,
+    item: str = None,
 ) -> Embed:
     if (
         role := getattr(user, "top_role", None)
@@ -74,18 +90,10 @@ def format_profile(
             name="Imię postaci", value=island.character_name, inline=False
         )
 
-    with db:
-        villagers = (
-            Villager.select(Villager.name)
-            .join(Residency)
-            .where(Residency.acprofile == island)
-            .order_by(Villager.name)
-            .tuples()
-        )
-        residents = [
-            f"[{n}](https://animalcrossing.fandom.com/wiki/{quote(n)})"
-            for n, in villagers
-        ]
+    residents = [
+        f"[{n}](https://animalcrossing.fandom.com/wiki/{quote(n)})"
+        for n in residents
+    ]
     if residents:
         embed.add_field(
             name=f"Mieszkańcy ({len(residents)}/10)",
@@ -114,6 +122,118 @@ def format_profile(
     return embed
 
 
+def update_island(user, create=True, **fields):
+    island = Island.get_or_none(Island.villager == user)
+    if not island:
+        if not create:
+            return None
+        island = Island(villager=user)
+    for field, value in fields.items():
+        setattr(island, field, value)
+    island.save()
+    return island
+
+
+def find_villagers(names):
+    return [gamedata.villagers.get(n) for n in names]
+
+
+def add_residents(user, villagers, mention):
+    island, created = Island.get_or_create(villager=user)
+    if not created:
+        if Residency.select().where(
+            Residency.acprofile == island
+        ).count() > 10 - len(villagers):
+            raise RzepaException(
+                f"{mention}, "
+                f"na wyspie możesz mieć maksymalnie 10 zwierzaków."
+            )
+    with db.atomic():
+        for villager in villagers:
+            try:
+                Residency.create(villager=villager.id, acprofile=island)
+            except IntegrityError:
+                raise RzepaException(
+                    f"{villager.name} jest już na twojej wyspie."
+                )
+
+
+def remove_residents(user, villagers):
+    """
+    Removes the given villagers from the user's island.
+
+    Returns the first villager who doesn't live on the island (in which case
+    nothing is removed), or None.
+    """
+    island, created = Island.get_or_create(villager=user)
+    residents = {
+        villager_id: residency_id
+        for residency_id, villager_id in Residency.select(
+            Residency.id, Residency.villager
+        )
+        .where(
+            Residency.acprofile == island,
+            Residency.villager.in_([v.id for v in villagers]),
+        )
+        .tuples()
+    }
+    for villager in villagers:
+        if villager.id not in residents:
+            return villager
+    Residency.delete().where(
+        Residency.id.in_(list(residents.values()))
+    ).execute()
+    return None
+
+
+def load_profile(db_user, guild):
+    island = Island.select().where(Island.villager == db_user).first()
+    if not island:
+        return None, (), None, None
+    item = None
+    now = now_string()
+    hot_item = (
+        HotItem.select(HotItem.item)
+        .where(HotItem.user == db_user, HotItem.expires_at > now)
+        .first()
+    )
+    if hot_item:
+        item = hot_item.item
+    dodocode = None
+    if guild is not None:
+        code = (
+            DodoCode.select(DodoCode.code)
+            .where(
+                DodoCode.user == db_user,
+                DodoCode.guild == guild,
+                DodoCode.expires_at > now,
+            )
+            .first()
+        )
+        if code:
+            dodocode = code.code
+    return island, get_residents(island), dodocode, item
+
+
+def get_guild_hot_items(guild):
+    return list(
+        HotItem.select(HotItem.item, User.discord_id)
+        .join(User)
+        .join(GuildMembership)
+        .where(
+            GuildMembership.guild == guild,
+            HotItem.expires_at > now_string(),
+        )
+        .distinct(True)
+        .tuples()
+    )
+
+
+def set_hot_item(user, item):
+    HotItem.delete().where(HotItem.user == user).execute()
+    HotItem.create(user=user, item=item)
+
+
 class Profil(commands.Cog):
     """Komendy dotyczące informacji o użytkownikach."""
 
@@ -135,11 +255,8 @@ class Profil(commands.Cog):
             raise RzepaException(
                 f"{owoc} nie jest możliwym natywnym owocem wyspy."
             )
-        with db:
-            user, _ = get_user_and_guild(ctx.author.id, ctx.guild, db)
-            island, _ = Island.get_or_create(villager=user)
-            island.native_fruit = fruit_index
-            island.save()
+        user, _ = await get_user_and_guild(ctx.author.id, ctx.guild)
+        await db_writer.submit(update_island, user, native_fruit=fruit_index)
         return await ctx.send(
             f"{_fruit.emoji} {ctx.author.mention}, zarejestrowano "
             f"**{_fruit.pl_name}** jako natywny owoc twojej wyspy."
@@ -151,11 +268,8 @@ class Profil(commands.Cog):
         Pozwala ustawić swój Friend Code.
         """
         fc = match_fc(friend_code)
-        with db:
-            user, _ = get_user_and_guild(ctx.author.id, ctx.guild, db)
-            island, _ = Island.get_or_create(villager=user)
-            island.friend_code = fc
-            island.save()
+        user, _ = await get_user_and_guild(ctx.author.id, ctx.guild)
+        await db_writer.submit(update_island, user, friend_code=fc)
         return await ctx.send(
             f"🤝 {ctx.author.mention}, zarejestrowano twój "
             f"kod `{format_fc(fc)}`."
@@ -173,18 +287,15 @@ class Profil(commands.Cog):
             nazwa = nazwa.strip()
             if not nazwa:
                 nazwa = None
-        with db:
-            user, _ = get_user_and_guild(ctx.author.id, ctx.guild, db)
-            island = Island.get_or_none(Island.villager == user)
-            if not island:
-                if not nazwa:
-                    return await ctx.send(
-                        f"🗿️ {ctx.author.mention}, nie masz profilu, "
-                        f"więc nie można wyczyścić nazwy twojej wyspy."
-                    )
-                island = Island(villager=user)
-            island.island_name = nazwa
-            island.save()
+        user, _ = await get_user_and_guild(ctx.author.id, ctx.guild)
+        island = await db_writer.submit(
+            update_island, user, create=bool(nazwa), island_name=nazwa
+        )
+        if not island:
+            return await ctx.send(
+                f"🗿️ {ctx.author.mention}, nie masz profilu, "
+                f"więc nie można wyczyścić nazwy twojej wyspy."
+            )
         if not nazwa:
             return await ctx.send(
                 f"🏝️ {ctx.author.mention}, wyczyszczono nazwę twojej wyspy."
@@ -206,18 +317,15 @@ class Profil(commands.Cog):
             nazwa = nazwa.strip()
             if not nazwa:
                 nazwa = None
-        with db:
-            user, _ = get_user_and_guild(ctx.author.id, ctx.guild, db)
-            island = Island.get_or_none(Island.villager == user)
-            if not island:
-                if not nazwa:
-                    return await ctx.send(
-                        f"🗿️ {ctx.author.mention}, nie masz profilu, "
-                        f"więc nie można wyczyścić imienia twojej postaci."
-                    )
-                island = Island(villager=user)
-            island.character_name = nazwa
-            island.save()
+        user, _ = await get_user_and_guild(ctx.author.id, ctx.guild)
+        island = await db_writer.submit(
+            update_island, user, create=bool(nazwa), character_name=nazwa
+        )
+        if not island:
+            return await ctx.send(
+                f"🗿️ {ctx.author.mention}, nie masz profilu, "
+                f"więc nie można wyczyścić imienia twojej postaci."
+            )
         if not nazwa:
             return await ctx.send(
                 f"🧒 {ctx.author.mention}, wyczyszczono imię twojej postaci."
@@ -233,37 +341,15 @@ class Profil(commands.Cog):
         Dodaje 1 lub więcej mieszkańców (rozdzielonych przecinkami) na wyspę.
         """
         villagers = [z.strip() for z in zwierzaki.split(",")]
-        with db:
-            user, _ = get_user_and_guild(ctx.author.id, ctx.guild, db)
-            island, created = Island.get_or_create(villager=user)
-            if not created:
-                if Residency.select().where(
-                    Residency.acprofile == island
-                ).count() > 10 - len(villagers):
-                    raise RzepaException(
-                        f"{ctx.author.mention}, "
-                        f"na wyspie możesz mieć maksymalnie 10 zwierzaków."
-                    )
-            valid_villagers = []
-            with db.atomic() as transaction:
-                for v in villagers:
-                    villager = (
-                        Villager.select().where(Villager.name ** v).first()
-                    )
-                    if not villager:
-                        clean = await commands.clean_content().convert(ctx, v)
-                        transaction.rollback()
-                        raise RzepaException(
-                            f"Nie ma takiego zwierzaka: {clean}"
-                        )
-                    valid_villagers.append(villager)
-                    try:
-                        Residency.create(villager=villager, acprofile=island)
-                    except IntegrityError:
-                        transaction.rollback()
-                        raise RzepaException(
-                            f"{villager.name} jest już na twojej " f"wyspie."
-                        )
+        valid_villagers = find_villagers(villagers)
+        for name, villager in zip(villagers, valid_villagers):
+            if not villager:
+                clean = await commands.clean_content().convert(ctx, name)
+                raise RzepaException(f"Nie ma takiego zwierzaka: {clean}")
+        user, _ = await get_user_and_guild(ctx.author.id, ctx.guild)
+        await db_writer.submit(
+            add_residents, user, valid_villagers, ctx.author.mention
+        )
         if len(valid_villagers) > 1:
             return await ctx.send(
                 f"🏕 {ctx.author.mention}, zarejestrowano "
@@ -296,26 +382,22 @@ class Profil(commands.Cog):
         Usuwa 1 lub więcej mieszkańców (rozdzielonych przecinkami) z wyspy.
         """
         villagers = [z.strip() for z in zwierzaki.split(",")]
-        with db:
-            user, _ = get_user_and_guild(ctx.author.id, ctx.guild, db)
-            island, created = Island.get_or_create(villager=user)
-            residencies = []
-            for v in villagers:
-                residency = (
-                    Residency.select()
-                    .join(Villager)
-                    .where(Residency.acprofile == island, Villager.name ** v)
-                    .first()
-                )
-                if not residency:
-                    clean = await commands.clean_content().convert(ctx, v)
-                    raise RzepaException(
-                        f"{ctx.author.mention}, na twojej wyspie "
-                        f"nie ma zwierzaka: {clean}"
-                    )
-                residencies.append(residency)
-            for residency in residencies:
-                residency.delete_instance()
+        user, _ = await get_user_and_guild(ctx.author.id, ctx.guild)
+        found = find_villagers(villagers)
+        if None in found:
+            missing = villagers[found.index(None)]
+        else:
+            not_resident = await db_writer.submit(
+                remove_residents, user, found
+            )
+            missing = not_resident.name if not_resident else None
+        if missing is not None:
+            clean = await commands.clean_content().convert(ctx, missing)
+            raise RzepaException(
+                f"{ctx.author.mention}, na twojej wyspie "
+                f"nie ma zwierzaka: {clean}"
+            )
+        villager = found[-1]
         message = ctx.invoked_with.replace("dź", "dz").replace("ć", "c")
         if message == "wyjeb":
             message = "wyjebano"
@@ -333,8 +415,8 @@ class Profil(commands.Cog):
                 colour=0x8AD88A,
                 description=f"🏕 {message.capitalize()} z "
                 f"twojej wyspy zwierzaka: "
-                f"{residency.villager.link}",
-            ).set_thumbnail(url=residency.villager.image_url),
+                f"{villager.link}",
+            ).set_thumbnail(url=villager.image_url),
         )
 
     @commands.command(aliases=["profil"])
@@ -346,37 +428,15 @@ class Profil(commands.Cog):
         """
         if user is None:
             user = ctx.author
-        with db:
-            db_user, _ = get_user_and_guild(user.id, ctx.guild, db)
-            island = Island.select().where(Island.villager == db_user).first()
-            item = None
-            hot_item = (
-                HotItem.select(HotItem.item)
-                .where(HotItem.user == db_user)
-                .first()
-            )
-            if hot_item:
-                item = hot_item.item
-            dodocode = None
-            if ctx.guild is not None:
-                code = (
-                    DodoCode.select(DodoCode.code)
-                    .join(User)
-                    .switch(DodoCode)
-                    .join(Guild)
-                    .where(
-                        Guild.discord_id == ctx.guild.id,
-                        User.discord_id == user.id,
-                    )
-                    .first()
-                )
-                if code:
-                    dodocode = code.code
+        db_user, guild = await get_user_and_guild(user.id, ctx.guild)
+        island, residents, dodocode, item = await db_pool.run(
+            load_profile, db_user, guild
+        )
         if not island:
             raise RzepaException(
                 f"Użytkownik {user.display_name} nie ma profilu."
             )
-        embed = format_profile(island, user, dodocode, item)
+        embed = format_profile(island, user, residents, dodocode, item)
         return await ctx.send(
             f"️🏝 **Profil użytkownika {user.display_name}** 🏝", embed=embed
         )
@@ -387,44 +447,31 @@ class Profil(commands.Cog):
         Ustawia Hot Item. Bez argumentów, wyświetla dzisiejsze hot itemy na tym serwerze.
         """
         t = tznow_dt()
-        with db:
-            if not item:
-                # get all
-                if not ctx.guild:
-                    raise commands.NoPrivateMessage()
-                g: DiscordGuild = ctx.guild
-                hot_items = (
-                    HotItem.select(HotItem.item, User.discord_id)
-                    .join(User)
-                    .join(GuildMembership)
-                    .join(Guild)
-                    .where(
-                        Guild.discord_id == g.id,
-                        HotItem.timestamp.day == t.day,
-                        HotItem.timestamp.month == t.month,
-                    )
-                    .distinct(True)
-                    .tuples()
-                )
-                s = f"📦 **Gorące przedmioty na {t.format('LL')}** 📦\n\n"
-                messages = []
-                for i in hot_items:
-                    user = g.get_member(i[1])
-                    if not user:
-                        continue
-                    line = f"**{user.display_name}**: {i[0]}\n"
-                    if len(s + line) > 1998:
-                        messages.append(s)
-                        s = ""
-                    s += line
-                messages.append(s)
-                for message in messages:
-                    return await ctx.send(message)
-            # set
-            user, _ = get_user_and_guild(ctx.author.id, ctx.guild, db)
-            item = await commands.clean_content().convert(ctx, item)
-            HotItem.delete().where(HotItem.user == user).execute()
-            HotItem.create(user=user, item=item)
-            return await ctx.send(
-                f"📦 Zarejestrowano twój dzisiejszy Hot Item: `{item}`"
-            )
+        if not item:
+            # get all
+            if not ctx.guild:
+                raise commands.NoPrivateMessage()
+            g: DiscordGuild = ctx.guild
+            _, guild = await get_user_and_guild(ctx.author.id, g)
+            hot_items = await db_pool.run(get_guild_hot_items, guild)
+            s = f"📦 **Gorące przedmioty na {t.format('LL')}** 📦\n\n"
+            messages = []
+            for i in hot_items:
+                user = g.get_member(i[1])
+                if not user:
+                    continue
+                line = f"**{user.display_name}**: {i[0]}\n"
+                if len(s + line) > 1998:
+                    messages.append(s)
+                    s = ""
+                s += line
+            messages.append(s)
+            for message in messages:
+                return await ctx.send(message)
+        # set
+        item = await commands.clean_content().convert(ctx, item)
+        user, _ = await get_user_and_guild(ctx.author.id, ctx.guild)
+        await db_writer.submit(set_hot_item, user, item)
+        return await ctx.send(
+            f"📦 Zarejestrowano twój dzisiejszy Hot Item: `{item}`"
+        )
@@ -0,0 +1,90 @@
+# Copyright (c) 2020 Slavfox
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+Per-command query statistics and the slow query log.
+
+Every query is timed and attributed to the command whose context it runs
+in. Queries slower than ``SQL_SLOW_QUERY_MS`` are always logged; a summary
+of the queries a command ran is only logged for a ``SQL_SAMPLE_RATE``
+fraction of invocations.
+"""
+from __future__ import annotations
+
+from typing import Optional
+from dataclasses import dataclass
+
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from random import random
+from time import perf_counter
+
+from peewee import SqliteDatabase
+
+from rzepabot.config import SQL_SAMPLE_RATE, SQL_SLOW_QUERY_MS
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class QueryStats:
+    command: str
+    queries: int = 0
+    total_ms: float = 0.0
+    slowest_ms: float = 0.0
+
+
+# Worker threads only see this if the job was submitted with a copy of the
+# submitter's context, as DatabasePool and DatabaseWriter do.
+current_stats: ContextVar[Optional[QueryStats]] = ContextVar(
+    "current_stats", default=None
+)
+
+
+class InstrumentedSqliteDatabase(SqliteDatabase):
+    def execute_sql(self, sql, params=None, *args, **kwargs):
+        start = perf_counter()
+        try:
+            return super().execute_sql(sql, params, *args, **kwargs)
+        finally:
+            # Time until the first row is ready; SQLite computes the rest
+            # as the cursor is iterated.
+            elapsed = (perf_counter() - start) * 1000
+            stats = current_stats.get()
+            if stats is not None:
+                stats.queries += 1
+                stats.total_ms += elapsed
+                stats.slowest_ms = max(stats.slowest_ms, elapsed)
+            if elapsed >= SQL_SLOW_QUERY_MS:
+                logger.warning(
+                    "Slow query in %s (%.1f ms): %s %r",
+                    stats.command if stats is not None else "background",
+                    elapsed,
+                    sql,
+                    params,
+                )
+
+
+@contextmanager
+def track_queries(command: str):
+    """Attributes the queries run within the block to ``command``."""
+    stats = QueryStats(command)
+    token = current_stats.set(stats)
+    start = perf_counter()
+    try:
+        yield stats
+    finally:
+        current_stats.reset(token)
+        if random() < SQL_SAMPLE_RATE:
+            logger.info(
+                "%s: %d queries, %.1f ms in SQL (slowest %.1f ms), "
+                "%.1f ms total",
+                command,
+                stats.queries,
+                stats.total_ms,
+                stats.slowest_ms,
+                (perf_counter() - start) * 1000,
+            )
@@ -0,0 +1,132 @@
+# Copyright (c) 2020 Slavfox
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+Substring and typo-tolerant search over a fixed set of names.
+
+Keys are expected to be normalized already (see gamedata.normalize_name),
+and so are queries.
+"""
+from __future__ import annotations
+
+from typing import Dict, Generic, Iterable, List, Set, Tuple, TypeVar
+
+T = TypeVar("T")
+
+NGRAM = 3
+MAX_TYPOS = 2
+
+
+def ngrams(s: str) -> Set[str]:
+    return {s[i : i + NGRAM] for i in range(len(s) - NGRAM + 1)}
+
+
+def osa_distance(a: str, b: str) -> int:
+    """
+    Optimal string alignment distance: Levenshtein distance which also
+    counts swapping two adjacent characters as a single edit.
+    """
+    d = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    for i in range(len(a) + 1):
+        d[i][0] = i
+    for j in range(len(b) + 1):
+        d[0][j] = j
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            d[i][j] = min(
+                d[i - 1][j] + 1, d[i][j - 1] + 1, d[i - 1][j - 1] + cost
+            )
+            if (
+                i > 1
+                and j > 1
+                and a[i - 1] == b[j - 2]
+                and a[i - 2] == b[j - 1]
+            ):
+                d[i][j] = min(d[i][j], d[i - 2][j - 2] + 1)
+    return d[len(a)][len(b)]
+
+
+def max_typos(query: str) -> int:
+    """How many edits a query of this length may be away from a match."""
+    return 1 if len(query) <= 4 else MAX_TYPOS
+
+
+def deletions(word: str, depth: int) -> Set[str]:
+    """Every string left after deleting up to ``depth`` characters."""
+    found = frontier = {word}
+    for _ in range(depth):
+        frontier = {
+            w[:i] + w[i + 1 :] for w in frontier for i in range(len(w))
+        }
+        found = found | frontier
+    return found
+
+
+class SearchIndex(Generic[T]):
+    """
+    Maps normalized keys to values, with a trigram inverted index for
+    substring queries and a deletion index for "did you mean" suggestions.
+
+    The deletion index maps every string left after deleting up to
+    MAX_TYPOS characters from a key back to the key. Two strings within k
+    edits of each other share such a string at depth k, so suggestions only
+    need to compute the edit distance to keys found under the query's own
+    deletions.
+    """
+
+    def __init__(self, items: Iterable[Tuple[str, T]]):
+        self._values: Dict[str, T] = dict(items)
+        self._postings: Dict[str, Set[str]] = {}
+        for key in self._values:
+            for gram in ngrams(key):
+                self._postings.setdefault(gram, set()).add(key)
+        self._deletions: Dict[str, Set[str]] = {}
+        for key in self._values:
+            for deleted in deletions(key, MAX_TYPOS):
+                self._deletions.setdefault(deleted, set()).add(key)
+        self._max_key_len = max(map(len, self._values), default=0)
+
+    def get(self, key: str):
+        return self._values.get(key)
+
+    def substring(self, query: str) -> List[T]:
+        """
+        Values whose key contains the query. Keys starting with it come
+        first, then ones containing it earlier, then shorter ones.
+        """
+        if not query:
+            return []
+        if len(query) < NGRAM:
+            candidates = self._values.keys()
+        else:
+            postings = sorted(
+                (self._postings.get(gram, set()) for gram in ngrams(query)),
+                key=len,
+            )
+            candidates = set.intersection(*postings)
+        matches = sorted(
+            (key.find(query), len(key), key)
+            for key in candidates
+            if query in key
+        )
+        return [self._values[key] for _, _, key in matches]
+
+    def suggest(self, query: str, limit: int = 5) -> List[T]:
+        """Values whose key is a few typos away from the query, best first."""
+        # Deletions grow combinatorially with the query's length, and a query
+        # this long can't be within MAX_TYPOS edits of any key anyway.
+        if not query or len(query) > self._max_key_len + MAX_TYPOS:
+            return []
+        typos = max_typos(query)
+        candidates = set()
+        for deleted in deletions(query, typos):
+            candidates |= self._deletions.get(deleted, set())
+        ranked = sorted(
+            (distance, abs(len(key) - len(query)), key)
+            for key in candidates
+            if (distance := osa_distance(query, key)) <= typos
+        )
+        return [self._values[key] for _, _, key in ranked[:limit]]
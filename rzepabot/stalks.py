@@ -5,19 +5,39 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+from typing import (
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from dataclasses import dataclass
+
+import asyncio
+import logging
+import struct
+import threading
+from collections import OrderedDict
 from datetime import datetime
 
-import matplotlib.dates as mdates
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
+import numpy as np
 
-from rzepabot.config import tznow_dt
-from rzepabot.persistence import StalkPrice, User, db
+from rzepabot.charts import chart_renderer, render_prices
+from rzepabot.config import FORECAST_CACHE_SIZE, tznow_dt
+from rzepabot.exceptions import RzepaException
+from rzepabot.persistence import (
+    GuildMembership,
+    StalkPrice,
+    TurnipForecast,
+    User,
+    db_pool,
+    db_writer,
+)
 
-if TYPE_CHECKING:
-    from matplotlib.pyplot import Axes
-    from typing import Sequence
+logger = logging.getLogger(__name__)
 
 
 def datetime_from_timestamp(ts):
@@ -30,33 +50,41 @@ def datetime_from_timestamp(ts):
     )
 
 
-def get_current_week_prices(user: User):
-    now = tznow_dt()
-    start_of_week = (
-        now.replace(weekday=6).subtract(weeks=1).replace(hour=7, minute=0)
+def week_start(now=None) -> str:
+    """Start of the turnip week containing ``now``, by default the current."""
+    if now is None:
+        now = tznow_dt()
+    # Turnip weeks start on Sunday.
+    return (
+        now.subtract(days=(now.weekday() + 1) % 7)
+        .start_of("day")
+        .to_datetime_string()
     )
-    with db:
-        prices = (
-            StalkPrice.select(StalkPrice.timestamp, StalkPrice.price)
-            .where(
-                StalkPrice.user == User,
-                StalkPrice.timestamp > start_of_week,
-                StalkPrice.is_buy_price == False,
-            )
-            .order_by(StalkPrice.timestamp)
+
+
+def get_current_week_prices(user: User):
+    start_of_week = week_start()
+    prices = list(
+        StalkPrice.select(StalkPrice.timestamp, StalkPrice.price)
+        .where(
+            StalkPrice.user == user,
+            StalkPrice.timestamp > start_of_week,
+            StalkPrice.is_buy_price == False,
         )
-        buyprice = (
-            StalkPrice.select(StalkPrice.price)
-            .where(
-                StalkPrice.user == User,
-                StalkPrice.timestamp > start_of_week,
-                StalkPrice.is_buy_price == True,
-            )
-            .order_by(StalkPrice.timestamp.desc())
-            .get_or_none()
+        .order_by(StalkPrice.timestamp)
+    )
+    buyprice = (
+        StalkPrice.select(StalkPrice.price)
+        .where(
+            StalkPrice.user == user,
+            StalkPrice.timestamp > start_of_week,
+            StalkPrice.is_buy_price == True,
         )
-        if buyprice is not None:
-            buyprice = buyprice.price
+        .order_by(StalkPrice.timestamp.desc())
+        .get_or_none()
+    )
+    if buyprice is not None:
+        buyprice = buyprice.price
     return prices, buyprice
 
 
@@ -72,60 +100,783 @@ def process_prices(prices):
     return datelist, pricelist
 
 
-def draw_plot(prices, buyprice=None):
-    datelist, pricelist = prices
-    with plt.xkcd():
-        fig, ax = plt.subplots()
-        ax: Axes
-        ax.plot(
-            datelist, pricelist, "o-", label="Cena sprzedaży u Nooklingów",
+async def render_week_chart(user: User) -> bytes:
+    """PNG chart of the user's prices this week."""
+    prices, buy_price = await db_pool.run(get_current_week_prices, user)
+    return await chart_renderer.render(*process_prices(prices), buy_price)
+
+
+# Patterns, in the order the game numbers them.
+FLUCTUATING, LARGE_SPIKE, DECREASING, SMALL_SPIKE = range(4)
+PATTERN_NAMES = ["wahający się", "duży skok", "malejący", "mały skok"]
+# Probability of this week's pattern (column) given last week's (row).
+TRANSITIONS = np.array(
+    [
+        [0.20, 0.30, 0.15, 0.35],
+        [0.50, 0.05, 0.20, 0.25],
+        [0.25, 0.45, 0.05, 0.25],
+        [0.45, 0.25, 0.15, 0.15],
+    ]
+)
+# Pattern probabilities in the long run, for when last week's is unknown.
+STATIONARY = np.linalg.matrix_power(TRANSITIONS, 64)[0]
+BASE_PRICES = np.arange(90, 111)
+# Sell prices change twice a day, Monday morning to Saturday afternoon.
+SLOTS = 12
+
+
+def slot_of(timestamp) -> Optional[int]:
+    """Index of the half-day a sell price was seen in, None on Sunday."""
+    if timestamp.weekday() == 6:
+        return None
+    return timestamp.weekday() * 2 + (timestamp.hour >= 12)
+
+
+def price_vector(sell_prices: Sequence[StalkPrice]) -> np.ndarray:
+    """Sell prices by half-day, NaN where there's none; later ones win."""
+    observed = np.full(SLOTS, np.nan)
+    for price in sell_prices:
+        slot = slot_of(price.timestamp)
+        if slot is not None:
+            observed[slot] = price.price
+    return observed
+
+
+# A run of sell prices is a list of (lowest rate, highest rate, offset) per
+# half-day; a price is intceil(rate * base price) + offset.
+
+
+def _random(low, high, n=1):
+    return [(low, high, 0)] * n
+
+
+def _decreasing(start_low, start_high, step_low, step_high, n):
+    """
+    Starts at a random rate, then drops by a random step every half-day.
+    The k-th rate's range grows with k, as the steps add up.
+    """
+    return [
+        (start_low - k * step_high, start_high - k * step_low, 0)
+        for k in range(n)
+    ]
+
+
+def scenario_templates():
+    """
+    Yields (pattern, probability within the pattern, run) for every way
+    the game can lay out a week, following its price generator.
+    """
+    for high_1 in range(7):
+        for high_3 in range(7 - high_1):
+            for decreasing_1 in (2, 3):
+                yield FLUCTUATING, 1 / (7 * (7 - high_1) * 2), [
+                    *_random(0.9, 1.4, high_1),
+                    *_decreasing(0.6, 0.8, 0.04, 0.1, decreasing_1),
+                    *_random(0.9, 1.4, 7 - high_1 - high_3),
+                    *_decreasing(0.6, 0.8, 0.04, 0.1, 5 - decreasing_1),
+                    *_random(0.9, 1.4, high_3),
+                ]
+    for peak_start in range(1, 8):
+        yield LARGE_SPIKE, 1 / 7, [
+            *_decreasing(0.85, 0.9, 0.03, 0.05, peak_start),
+            *_random(0.9, 1.4),
+            *_random(1.4, 2.0),
+            *_random(2.0, 6.0),
+            *_random(1.4, 2.0),
+            *_random(0.9, 1.4),
+            *_random(0.4, 0.9, SLOTS - peak_start - 5),
+        ]
+    yield DECREASING, 1.0, _decreasing(0.85, 0.9, 0.03, 0.05, SLOTS)
+    for peak_start in range(8):
+        yield SMALL_SPIKE, 1 / 8, [
+            *_decreasing(0.4, 0.9, 0.03, 0.05, peak_start),
+            *_random(0.9, 1.4, 2),
+            # The middle price of the peak is the highest one.
+            (1.4, 2.0, -1),
+            (1.4, 2.0, 0),
+            (1.4, 2.0, -1),
+            *_decreasing(0.4, 0.9, 0.03, 0.05, SLOTS - peak_start - 5),
+        ]
+
+
+def intceil(x):
+    # The game's rounding, (int)(x + 0.99999).
+    return np.trunc(x + 0.99999).astype(np.int32)
+
+
+class Scenarios(NamedTuple):
+    """
+    Every week the game can generate, as flat arrays with one row per
+    template and base price.
+    """
+
+    pattern: np.ndarray
+    base_price: np.ndarray
+    # Probability within the pattern, for a given base price.
+    weight: np.ndarray
+    # Range of possible sell prices in every half-day, inclusive.
+    low: np.ndarray
+    high: np.ndarray
+
+
+def enumerate_scenarios(base_prices: np.ndarray = BASE_PRICES) -> Scenarios:
+    patterns, weights, runs = zip(*scenario_templates())
+    runs = np.array(runs)
+    rates_low, rates_high = runs[..., 0], runs[..., 1]
+    offsets = runs[..., 2].astype(np.int32)
+    base = base_prices[:, None, None]
+    return Scenarios(
+        pattern=np.tile(patterns, len(base_prices)),
+        base_price=np.repeat(base_prices, len(patterns)),
+        weight=np.tile(weights, len(base_prices)),
+        # Prices stay well within int16, which halves the memory traffic.
+        low=(intceil(rates_low * base) + offsets)
+        .reshape(-1, SLOTS)
+        .astype(np.int16),
+        high=(intceil(rates_high * base) + offsets)
+        .reshape(-1, SLOTS)
+        .astype(np.int16),
+    )
+
+
+SCENARIOS = enumerate_scenarios()
+
+
+def pattern_prior(previous_pattern: Optional[int] = None) -> np.ndarray:
+    if previous_pattern is None:
+        return STATIONARY
+    return TRANSITIONS[previous_pattern]
+
+
+def likelihoods(
+    observed: np.ndarray,
+    buy_price: Optional[int] = None,
+    previous_pattern: Optional[int] = None,
+    scenarios: Scenarios = SCENARIOS,
+) -> np.ndarray:
+    """
+    Probability of every scenario producing the observed sell prices (up to
+    a common factor), assuming every price within a half-day's range is
+    equally likely.
+    """
+    seen = ~np.isnan(observed)
+    prices = observed[seen]
+    low, high = scenarios.low[:, seen], scenarios.high[:, seen]
+    fits = ((low <= prices) & (prices <= high)).all(axis=1)
+    density = 1 / (high - low + 1).prod(axis=1, dtype=np.float64)
+    result = (
+        pattern_prior(previous_pattern)[scenarios.pattern]
+        * scenarios.weight
+        * fits
+        * density
+    )
+    if buy_price is None:
+        return result / len(BASE_PRICES)
+    # The buy price on Sunday is the base price.
+    return result * (scenarios.base_price == buy_price)
+
+
+class BatchForecast(NamedTuple):
+    """Forecasts for many users at once, one row per user."""
+
+    # Probability of each pattern, NaN if the prices fit none.
+    patterns: np.ndarray
+    # Lowest and highest possible price in every half-day (the price itself
+    # where it's known), -1 if the prices fit no pattern.
+    low: np.ndarray
+    high: np.ndarray
+
+
+def forecast_batch(
+    observed: np.ndarray,
+    buy_prices: np.ndarray,
+    previous_patterns: Optional[np.ndarray] = None,
+    scenarios: Scenarios = SCENARIOS,
+) -> BatchForecast:
+    """
+    Scores every user's prices against every scenario in one pass.
+
+    ``observed`` holds one row of sell prices per user, NaN where there's
+    none, and ``buy_prices`` the buy prices, NaN if unknown.
+    ``previous_patterns`` are last week's patterns, -1 if unknown. Users
+    with the same prices are only scored once.
+    """
+    if previous_patterns is None:
+        previous_patterns = np.full(len(observed), -1)
+    rows, inverse = np.unique(
+        np.column_stack(
+            [
+                np.nan_to_num(observed, nan=-1),
+                np.nan_to_num(buy_prices, nan=-1),
+                previous_patterns,
+            ]
+        ).astype(np.int32),
+        axis=0,
+        return_inverse=True,
+    )
+    prices, buy, previous = rows[:, :SLOTS], rows[:, SLOTS], rows[:, -1]
+    seen = prices >= 0
+    width = scenarios.high - scenarios.low + 1
+    fits = (buy[:, None] < 0) | (buy[:, None] == scenarios.base_price)
+    for slot in range(SLOTS):
+        users = np.flatnonzero(seen[:, slot])
+        if len(users):
+            # low <= price <= high, in a single comparison.
+            fits[users] &= (
+                prices[users, slot, None] - scenarios.low[:, slot]
+            ).astype(np.uint16) < width[:, slot]
+    # Probability of the seen prices given each scenario, times the
+    # scenario's probability within its pattern, summed up by pattern. The
+    # pattern's prior only depends on the user, so it's applied last.
+    scores = np.exp(seen @ -np.log(width.T) + np.log(scenarios.weight))
+    np.multiply(scores, fits, out=scores)
+    by_pattern = (scores @ np.eye(4)[scenarios.pattern]) * np.where(
+        previous[:, None] < 0, STATIONARY, TRANSITIONS[previous]
+    )
+    with np.errstate(invalid="ignore"):
+        patterns = by_pattern / by_pattern.sum(axis=1, keepdims=True)
+    # max() of a product is much faster than min() or max() over where();
+    # infeasible scenarios count as 0, so the lowest price is found as the
+    # highest distance from a ceiling.
+    ceiling = scenarios.high.max() + 1
+    low = np.empty_like(prices)
+    high = np.empty_like(prices)
+    for slot in range(SLOTS):
+        low[:, slot] = ceiling - (
+            fits * (ceiling - scenarios.low[:, slot])
+        ).max(axis=1)
+        high[:, slot] = (fits * scenarios.high[:, slot]).max(axis=1)
+    low[seen] = high[seen] = prices[seen]
+    low[~fits.any(axis=1)] = -1
+    high[~fits.any(axis=1)] = -1
+    return BatchForecast(patterns[inverse], low[inverse], high[inverse])
+
+
+def guess_pattern(
+    buy_price: Optional[int] = None,
+    sell_prices: Sequence[StalkPrice] = (),
+    previous_pattern: Optional[int] = None,
+) -> Optional[np.ndarray]:
+    """
+    Probability of each pattern given this week's prices, or None if they
+    don't fit any pattern.
+    """
+    scores = likelihoods(
+        price_vector(sell_prices), buy_price, previous_pattern
+    )
+    total = scores.sum()
+    if not total:
+        return None
+    return np.bincount(SCENARIOS.pattern, scores, minlength=4) / total
+
+
+class PriceRange(NamedTuple):
+    low: int
+    high: int
+    # Where the middle half of the probability lies.
+    likely_low: int
+    likely_high: int
+
+
+# Forecast keys and summaries store prices as int16.
+MAX_PRICE = np.iinfo(np.int16).max
+# Buy price, previous pattern and sell prices, -1 where unknown.
+FORECAST_KEY = struct.Struct(f"<hb{SLOTS}h")
+# Pattern probabilities (NaN if the prices fit none), then the low, high,
+# likely low and likely high price of every half-day (-1 if it's known).
+FORECAST_SUMMARY = struct.Struct(f"<4f{SLOTS * 4}h")
+
+
+def forecast_key(
+    buy_price: Optional[int],
+    observed: np.ndarray,
+    previous_pattern: Optional[int] = None,
+) -> bytes:
+    return FORECAST_KEY.pack(
+        -1 if buy_price is None else buy_price,
+        -1 if previous_pattern is None else previous_pattern,
+        *np.nan_to_num(observed, nan=-1).astype(int).tolist(),
+    )
+
+
+class ForecastSummary(NamedTuple):
+    """What's shown to users out of a forecast."""
+
+    patterns: Optional[np.ndarray]
+    ranges: List[Optional[PriceRange]]
+
+    def pack(self) -> bytes:
+        patterns = [np.nan] * 4 if self.patterns is None else self.patterns
+        ranges = [
+            value
+            for price_range in self.ranges
+            for value in (price_range or (-1,) * 4)
+        ]
+        return FORECAST_SUMMARY.pack(*patterns, *ranges)
+
+    @classmethod
+    def unpack(cls, data: bytes) -> ForecastSummary:
+        values = FORECAST_SUMMARY.unpack(data)
+        patterns = np.array(values[:4], dtype=np.float64)
+        ranges = [
+            None if values[i] == -1 else PriceRange(*values[i : i + 4])
+            for i in range(4, len(values), 4)
+        ]
+        return cls(None if np.isnan(patterns).any() else patterns, ranges)
+
+
+@dataclass(frozen=True)
+class Forecast:
+    """
+    A week's prices so far, together with the scenarios that still fit them
+    and their likelihoods.
+
+    New prices only need to be checked against the remaining scenarios, so
+    entering them one by one is much cheaper than starting over each time.
+    """
+
+    buy_price: Optional[int]
+    previous_pattern: Optional[int]
+    observed: np.ndarray
+    # Indices into SCENARIOS, and their (unnormalized) likelihoods.
+    candidates: np.ndarray
+    scores: np.ndarray
+
+    @classmethod
+    def from_vector(
+        cls,
+        observed: np.ndarray,
+        buy_price: Optional[int] = None,
+        previous_pattern: Optional[int] = None,
+    ) -> Forecast:
+        scores = likelihoods(observed, buy_price, previous_pattern)
+        candidates = np.flatnonzero(scores)
+        return cls(
+            buy_price,
+            previous_pattern,
+            observed,
+            candidates,
+            scores[candidates],
+        )
+
+    @classmethod
+    def from_prices(
+        cls,
+        buy_price: Optional[int] = None,
+        sell_prices: Sequence[StalkPrice] = (),
+        previous_pattern: Optional[int] = None,
+    ) -> Forecast:
+        return cls.from_vector(
+            price_vector(sell_prices), buy_price, previous_pattern
+        )
+
+    @property
+    def key(self) -> bytes:
+        return forecast_key(
+            self.buy_price, self.observed, self.previous_pattern
+        )
+
+    def summary(self) -> ForecastSummary:
+        return ForecastSummary(self.patterns, self.ranges())
+
+    def observe(self, slot: int, price: int) -> Forecast:
+        """The forecast after seeing a sell price in the given half-day."""
+        seen = self.observed[slot]
+        if seen == price:
+            return self
+        observed = self.observed.copy()
+        observed[slot] = price
+        if not np.isnan(seen):
+            # A corrected price can bring back scenarios ruled out before.
+            return Forecast.from_vector(
+                observed, self.buy_price, self.previous_pattern
+            )
+        low = SCENARIOS.low[self.candidates, slot]
+        high = SCENARIOS.high[self.candidates, slot]
+        fits = (low <= price) & (price <= high)
+        return Forecast(
+            self.buy_price,
+            self.previous_pattern,
+            observed,
+            self.candidates[fits],
+            self.scores[fits] / (high - low + 1)[fits],
         )
-        ax.xaxis.set_major_locator(mdates.DayLocator())
-        ax.xaxis.set_minor_locator(mdates.HourLocator())
-        ax.xaxis.set_major_formatter(mdates.DateFormatter("%d/%m"))
-
-        if buyprice:
-            ax.plot(
-                datelist,
-                [buyprice for _ in datelist],
-                label="Cena kupna u Daisy",
+
+    def observe_buy_price(self, price: int) -> Forecast:
+        if price == self.buy_price:
+            return self
+        if self.buy_price is not None:
+            return Forecast.from_vector(
+                self.observed, price, self.previous_pattern
             )
+        fits = SCENARIOS.base_price[self.candidates] == price
+        return Forecast(
+            price,
+            self.previous_pattern,
+            self.observed,
+            self.candidates[fits],
+            self.scores[fits],
+        )
+
+    @property
+    def patterns(self) -> Optional[np.ndarray]:
+        """Probability of each pattern, None if the prices fit none."""
+        total = self.scores.sum()
+        if not total:
+            return None
+        pattern = SCENARIOS.pattern[self.candidates]
+        return np.bincount(pattern, self.scores, minlength=4) / total
 
-        for i, p in enumerate(pricelist):
-            ax.annotate(
-                p, (datelist[i], p), (0, 10), textcoords="offset " "pixels"
+    def ranges(self) -> List[Optional[PriceRange]]:
+        """
+        Possible prices in every half-day, None for the ones already seen
+        (and all of them if the prices fit no pattern).
+        """
+        result: List[Optional[PriceRange]] = [None] * SLOTS
+        if not len(self.candidates):
+            return result
+        weights = self.scores / self.scores.sum()
+        for slot in np.flatnonzero(np.isnan(self.observed)):
+            low = SCENARIOS.low[self.candidates, slot]
+            high = SCENARIOS.high[self.candidates, slot]
+            lowest = low.min()
+            # Every price in a scenario's range is equally likely, so the
+            # price distribution is a step function, built from where each
+            # range starts and ends.
+            density = weights / (high - low + 1)
+            size = high.max() - lowest + 2
+            steps = np.bincount(
+                low - lowest, density, minlength=size
+            ) - np.bincount(high + 1 - lowest, density, minlength=size)
+            cdf = np.cumsum(np.cumsum(steps))
+            likely_low, likely_high = np.searchsorted(cdf, [0.25, 0.75])
+            result[slot] = PriceRange(
+                int(lowest),
+                int(high.max()),
+                int(lowest + likely_low),
+                int(lowest + min(likely_high, size - 2)),
             )
+        return result
 
-        ax.set_ylabel("Dzwoneczki")
-        fig.autofmt_xdate()
-        ax.grid(axis="y")
-        fig.tight_layout()
-        return fig, ax
 
+class WeeklyForecasts:
+    """
+    Each user's forecast for the current turnip week, updated as they enter
+    prices. Forecasts for earlier weeks are dropped once a new one starts.
+    """
 
-def fit_small_spike(sell_prices: Sequence[StalkPrice], buy_price=None):
-    likelihood = 0
+    def __init__(self):
+        # Updated from database worker threads and the event loop.
+        self._lock = threading.Lock()
+        self._forecasts: Dict[int, Tuple[str, Forecast]] = {}
+        self._week: Optional[str] = None
 
-    if buy_price is None:
-        buy_price_range = 0.4 * 90, 0.9 * 110
-    else:
-        buy_price_range = buy_price, buy_price
-
-    # Match initial base rate
-    guess_monday_session1_price  # TODO
-    dt = datetime_from_timestamp(sell_prices[0].timestamp)
-    if dt.weekday() == 0:
-        if dt.hour < 12:
-            monday_session1_price_range = (
-                sell_prices[0].price,
-                sell_prices[0].price,
+    def __len__(self):
+        return len(self._forecasts)
+
+    def peek(self, user_id: int, week: str) -> Optional[Forecast]:
+        tracked = self._forecasts.get(user_id)
+        if tracked is not None and tracked[0] == week:
+            return tracked[1]
+        return None
+
+    def _put(self, user_id: int, week: str, forecast: Forecast):
+        # Moves on to the week if it's newer, and ignores ones already over.
+        if self._week is None or week > self._week:
+            self._forget_week(week)
+            self._week = week
+        if week == self._week:
+            self._forecasts[user_id] = week, forecast
+
+    def put(self, user_id: int, week: str, forecast: Forecast):
+        with self._lock:
+            self._put(user_id, week, forecast)
+
+    def get(
+        self, user_id: int, week: str, load: Callable[[], Forecast]
+    ) -> Forecast:
+        """The user's forecast, calling ``load`` if it's not tracked yet."""
+        forecast = self.peek(user_id, week)
+        if forecast is None:
+            forecast = load()
+            self.put(user_id, week, forecast)
+        return forecast
+
+    def observe(
+        self,
+        user_id: int,
+        week: str,
+        price: int,
+        slot: Optional[int] = None,
+        is_buy_price: bool = False,
+    ) -> Optional[Forecast]:
+        """
+        Narrows the user's forecast down with a price they just entered.
+        Returns None if the user's forecast for the week isn't tracked, so
+        that it will be loaded from the database on the next get().
+        """
+        with self._lock:
+            forecast = self.peek(user_id, week)
+            if forecast is None:
+                self._forecasts.pop(user_id, None)
+                return None
+            if is_buy_price:
+                forecast = forecast.observe_buy_price(price)
+            elif slot is not None:
+                forecast = forecast.observe(slot, price)
+            self._put(user_id, week, forecast)
+            return forecast
+
+    def _forget_week(self, week: str):
+        self._forecasts = {
+            user_id: tracked
+            for user_id, tracked in self._forecasts.items()
+            if tracked[0] == week
+        }
+
+    def forget_week(self, week: str):
+        """Drops forecasts for weeks other than the given one."""
+        with self._lock:
+            self._forget_week(week)
+
+
+weekly_forecasts = WeeklyForecasts()
+
+
+def load_forecast(
+    user: User, previous_pattern: Optional[int] = None
+) -> Forecast:
+    """Builds the user's forecast for the current week from the database."""
+    prices, buy_price = get_current_week_prices(user)
+    return Forecast.from_prices(buy_price, prices, previous_pattern)
+
+
+class ForecastMemo:
+    """
+    Forecast summaries by the prices they were made from, in an LRU in front
+    of the turnip_forecast table. Users who entered the same prices share an
+    entry.
+
+    Also remembers which entry every user's current week maps to, so that
+    showing the same forecast again doesn't even load their prices;
+    record_stalk_price() drops that, and so does the start of a new week.
+    Every drop bumps the user's version, so a forecast that was being made
+    from the prices before it isn't remembered afterwards.
+    """
+
+    def __init__(self, capacity: int = FORECAST_CACHE_SIZE):
+        self.capacity = capacity
+        # Looked up from database worker threads.
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[bytes, ForecastSummary] = OrderedDict()
+        self._users: Dict[int, Tuple[str, Optional[int], bytes]] = {}
+        self._versions: Dict[int, int] = {}
+        self._week: Optional[str] = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def cached(self, key: bytes) -> Optional[ForecastSummary]:
+        """Looks the key up in memory only."""
+        with self._lock:
+            summary = self._entries.get(key)
+            if summary is not None:
+                self._entries.move_to_end(key)
+            return summary
+
+    def put(self, key: bytes, summary: ForecastSummary):
+        with self._lock:
+            self._entries[key] = summary
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def lookup(self, key: bytes) -> Optional[ForecastSummary]:
+        """Looks the key up in memory, then in the database."""
+        summary = self.cached(key)
+        if summary is None:
+            data = (
+                TurnipForecast.select(TurnipForecast.forecast)
+                .where(TurnipForecast.key == key)
+                .scalar()
             )
-        else:
-            monday_session1_price_range = ...
+            if data is not None:
+                summary = ForecastSummary.unpack(data)
+                self.put(key, summary)
+        return summary
+
+    def user_key(
+        self, user_id: int, week: str, previous_pattern: Optional[int]
+    ) -> Optional[bytes]:
+        entry = self._users.get(user_id)
+        if entry is not None and entry[:2] == (week, previous_pattern):
+            return entry[2]
+        return None
+
+    def user_version(self, user_id: int) -> int:
+        return self._versions.get(user_id, 0)
+
+    def remember_user(
+        self,
+        user_id: int,
+        week: str,
+        previous_pattern: Optional[int],
+        key: bytes,
+        version: int,
+    ):
+        """
+        Remembers the user's entry, unless they entered a price since
+        ``version`` was read.
+        """
+        if self._week is None or week > self._week:
+            self._users = {}
+            self._versions = {}
+            self._week = week
+        if week == self._week and version == self.user_version(user_id):
+            self._users[user_id] = week, previous_pattern, key
+
+    def forget_user(self, user_id: int):
+        self._users.pop(user_id, None)
+        self._versions[user_id] = self.user_version(user_id) + 1
+
+
+forecast_memo = ForecastMemo()
+
+
+def store_forecast(key: bytes, summary: ForecastSummary):
+    TurnipForecast.insert(
+        key=key, forecast=summary.pack()
+    ).on_conflict_replace().execute()
+
+
+def find_forecast(
+    user: User, week: str, previous_pattern: Optional[int] = None
+) -> Tuple[bytes, ForecastSummary, bool]:
+    """
+    Returns the key and summary of the user's forecast, and whether it was
+    memoized already.
+    """
+    prices, buy_price = get_current_week_prices(user)
+    observed = price_vector(prices)
+    key = forecast_key(buy_price, observed, previous_pattern)
+    summary = forecast_memo.lookup(key)
+    if summary is not None:
+        return key, summary, True
+    # Narrowed down as the user entered prices, if possible.
+    forecast = weekly_forecasts.peek(user.id, week)
+    if forecast is None or forecast.key != key:
+        forecast = Forecast.from_vector(observed, buy_price, previous_pattern)
+        weekly_forecasts.put(user.id, week, forecast)
+    summary = forecast.summary()
+    forecast_memo.put(key, summary)
+    return key, summary, False
+
+
+def _forecast_stored(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(
+            "Failed to store a turnip forecast", exc_info=future.exception()
+        )
+
+
+async def get_forecast(
+    user: User, previous_pattern: Optional[int] = None
+) -> ForecastSummary:
+    """The user's forecast for the current week."""
+    week = week_start()
+    key = forecast_memo.user_key(user.id, week, previous_pattern)
+    if key is not None:
+        summary = forecast_memo.cached(key)
+        if summary is not None:
+            return summary
+    version = forecast_memo.user_version(user.id)
+    key, summary, stored = await db_pool.run(
+        find_forecast, user, week, previous_pattern
+    )
+    forecast_memo.remember_user(
+        user.id, week, previous_pattern, key, version
+    )
+    if not stored:
+        # Write-behind: the forecast is already in memory.
+        asyncio.ensure_future(
+            db_writer.submit(store_forecast, key, summary)
+        ).add_done_callback(_forecast_stored)
+    return summary
+
+
+def insert_stalk_price(user: User, price: int, is_buy_price: bool, now):
+    StalkPrice.insert(
+        user=user,
+        price=price,
+        is_buy_price=is_buy_price,
+        timestamp=now.to_datetime_string(),
+    ).execute()
+
 
+async def record_stalk_price(
+    user: User, price: int, is_buy_price: bool = False
+):
+    """
+    Saves a price the user just saw, and updates their forecast for the
+    week to match.
+    """
+    if not 0 < price <= MAX_PRICE:
+        raise RzepaException(f"{price} nie jest poprawną ceną rzepy.")
+    now = tznow_dt()
+    await db_writer.submit(insert_stalk_price, user, price, is_buy_price, now)
+    forecast_memo.forget_user(user.id)
+    weekly_forecasts.observe(
+        user.id, week_start(now), price, slot_of(now), is_buy_price
+    )
+
+
+def get_guild_week_prices(guild, week: str):
+    """
+    Returns the Discord ids of the guild's members who entered prices this
+    week, their sell prices (one row each) and their buy prices.
+    """
+    rows = (
+        StalkPrice.select(
+            User.discord_id,
+            StalkPrice.timestamp,
+            StalkPrice.price,
+            StalkPrice.is_buy_price,
+        )
+        .join(User)
+        .switch(StalkPrice)
+        .join(GuildMembership, on=GuildMembership.user == StalkPrice.user)
+        .where(GuildMembership.guild == guild, StalkPrice.timestamp > week)
+        .order_by(StalkPrice.timestamp)
+        .tuples()
+    )
+    users: Dict[int, int] = {}
+    sell_prices: List[Tuple[int, int, int]] = []
+    buy_prices: List[Tuple[int, int]] = []
+    for discord_id, timestamp, price, is_buy_price in rows:
+        user = users.setdefault(discord_id, len(users))
+        if is_buy_price:
+            buy_prices.append((user, price))
+        elif (slot := slot_of(timestamp)) is not None:
+            sell_prices.append((user, slot, price))
+    observed = np.full((len(users), SLOTS), np.nan)
+    buy = np.full(len(users), np.nan)
+    # Later prices win, like in price_vector().
+    for user, slot, price in sell_prices:
+        observed[user, slot] = price
+    for user, price in buy_prices:
+        buy[user] = price
+    return list(users), observed, buy
 
-def guess_pattern(buy_price=None, sell_prices=()):
-    ...
+
+def forecast_guild(guild) -> Tuple[List[int], BatchForecast]:
+    """
+    Forecasts for every member of the guild who entered prices this week,
+    by Discord id.
+    """
+    discord_ids, observed, buy_prices = get_guild_week_prices(
+        guild, week_start()
+    )
+    return discord_ids, forecast_batch(observed, buy_prices)
 
 
 if __name__ == "__main__":
@@ -145,5 +896,5 @@ if __name__ == "__main__":
         )
     del prices[3:4]
     del prices[6:8]
-    fig, ax = draw_plot(process_prices(prices), 94)
-    fig.savefig("plot.png")
+    with open("plot.png", "wb") as f:
+        f.write(render_prices(*process_prices(prices), 94))
@@ -1,6 +1,24 @@
 #!/usr/bin/env bash
+before=$(git rev-parse HEAD)
 git pull --recurse-submodules
 poetry install
 source .env
+poetry run python -m rzepabot.migrations
+poetry run python -m rzepabot.data.bundle
 poetry run python update_game_data.py
-./run.sh
+
+# The bot itself, but not the poetry process that started it.
+bot='^[^ ]*python[^ ]* -m rzepabot$'
+# Game data sources are read by update_game_data.py, not by the bot, so a
+# running bot only needs to reload the files it just wrote (on SIGHUP, like
+# $przeładuj). Anything else changing means new code, which needs a restart.
+if git diff --quiet "$before" HEAD -- . ':!rzepabot/data' \
+    && pkill -HUP -f "$bot"; then
+    echo "Reloaded game data in the running bot."
+else
+    # Not through screen, which would send the bot a SIGHUP.
+    pkill -TERM -f "$bot"
+    while pgrep -f "$bot" > /dev/null; do sleep 1; done
+    screen -S rzepabot -X quit
+    ./run.sh
+fi
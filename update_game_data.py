@@ -5,88 +5,210 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 from __future__ import annotations
 
+from typing import Dict, Iterable, List, Optional, Set
+from dataclasses import dataclass, field
+
+import os
+import shutil
+from hashlib import blake2b
 from pathlib import Path
+
+from peewee import chunked
+
+from rzepabot.cards import CardArchive, write as write_cards
 from rzepabot.data import bugs, fish, villagers
-from rzepabot.persistence import Critter, Villager, db
-from rzepabot.config import RZEPABOT_ROOT
+from rzepabot.persistence import (
+    Critter,
+    Villager,
+    attach_static,
+    db,
+    transaction,
+)
+from rzepabot.config import RZEPABOT_ROOT, STATIC_DB_PATH
 
 CARDSPATH = Path(__file__).parent / "CARDS"
+# Where cards used to be stored, one file each.
+CARDS_DEST = RZEPABOT_ROOT / "rzepabot" / "data" / "cards"
+
+VILLAGER_FIELDS = [
+    Villager.name,
+    Villager.image_url,
+    Villager.personality,
+    Villager.species,
+    Villager.birthday_month,
+    Villager.birthday_day,
+    Villager.catchphrase,
+]
+CRITTER_FIELDS = [
+    Critter.name,
+    Critter.price,
+    Critter.location,
+    Critter.time_mask,
+    Critter.month_mask,
+    Critter.is_fish,
+]
+
+
+@dataclass
+class SyncReport:
+    created: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
 
+    def __str__(self):
+        lines = [
+            f"{len(self.created)} created, {len(self.changed)} changed, "
+            f"{len(self.removed)} removed."
+        ]
+        for label, names in (
+            ("Created", self.created),
+            ("Changed", self.changed),
+            ("Removed", self.removed),
+        ):
+            if names:
+                lines.append(f"{label}: {', '.join(names)}")
+        return "\n".join(lines)
 
-def update_villagers():
-    created = 0
-    updated = 0
-    for row in villagers:
-        name, image_url, personality, species, birthday, catchphrase = row
+
+def villager_rows():
+    for name, image_url, personality, species, birthday, catchphrase in (
+        villagers
+    ):
         bm, bd = birthday
-        villager, was_created = Villager.get_or_create(
-            name=name,
-            defaults={
-                "catchphrase": catchphrase,
-                "birthday_month": bm,
-                "birthday_day": bd,
-                "species": species,
-                "personality": personality,
-                "image_url": image_url,
-            },
-        )
-        created += was_created
-        villager.catchphrase = catchphrase
-        villager.birthday_month = bm
-        villager.birthday_day = bd
-        villager.species = species
-        villager.personality = personality
-        villager.image_url = image_url
-        updated += villager.save()
-        cards = list(CARDSPATH.glob(f"**/*{name}.bin"))
-        if cards:
-            cards[0].rename(
-                RZEPABOT_ROOT / "rzepabot" / "data" / "cards" / f"{name}.bin"
-            )
-
-    return created, updated
-
-
-def update_critter(row, is_fish):
-    name, price, location, hour_bitmask, month_bitmask = row
-    critter, created = Critter.get_or_create(
-        name=name,
-        defaults={
-            "price": price,
-            "time_mask": hour_bitmask,
-            "month_mask": month_bitmask,
-            "location": location,
-            "is_fish": is_fish,
-        },
+        yield name, image_url, personality, species, bm, bd, catchphrase
+
+
+def critter_rows():
+    for rows, is_fish in ((fish, True), (bugs, False)):
+        for name, price, location, hour_bitmask, month_bitmask in rows:
+            yield name, price, location, hour_bitmask, month_bitmask, is_fish
+
+
+def row_hash(row) -> bytes:
+    return blake2b(repr(tuple(row)).encode(), digest_size=16).digest()
+
+
+def sync(model, fields, rows) -> SyncReport:
+    """
+    Makes the model's table contain exactly the given rows, matched by their
+    first field (the name). Rows whose contents didn't change are skipped,
+    the rest are upserted in bulk, keeping the ids of existing rows.
+    """
+    existing = {
+        row[1]: (row[0], row_hash(row[1:]))
+        for row in model.select(model.id, *fields).tuples()
+    }
+    report = SyncReport()
+    upserts = []
+    for row in rows:
+        name = row[0]
+        current = existing.pop(name, None)
+        if current is None:
+            report.created.append(name)
+            upserts.append((None, *row))
+        elif current[1] != row_hash(row):
+            report.changed.append(name)
+            upserts.append((current[0], *row))
+    report.removed = sorted(existing)
+    # Stay well under SQLite's limit on the number of query parameters.
+    for batch in chunked(upserts, 100):
+        model.insert_many(batch, fields=[model.id, *fields]).on_conflict(
+            conflict_target=[model.id], preserve=fields
+        ).execute()
+    if existing:
+        model.delete().where(
+            model.id.in_([pk for pk, _ in existing.values()])
+        ).execute()
+    return report
+
+
+@dataclass
+class CardIndex:
+    # Villager name -> the card file to use.
+    cards: Dict[str, Path] = field(default_factory=dict)
+    # Byte-for-byte copies of cards in ``cards``.
+    duplicates: List[Path] = field(default_factory=list)
+    # Villagers with more than one distinct card; the first one is used.
+    conflicts: Dict[str, List[Path]] = field(default_factory=dict)
+
+
+def card_owner(stem: str, names: Set[str]) -> Optional[str]:
+    """
+    The longest villager name the file name ends with, starting at a word
+    boundary, so that "Kid Cat" wins over "Cat" and "Hal" doesn't match "Al".
+    """
+    for i in range(len(stem)):
+        if (i == 0 or not stem[i - 1].isalnum()) and stem[i:] in names:
+            return stem[i:]
+    return None
+
+
+def index_cards(root: Path, names: Iterable[str]) -> CardIndex:
+    """Walks the card tree once, matching every card to a villager."""
+    names = set(names)
+    found: Dict[str, Dict[bytes, List[Path]]] = {}
+    for path in sorted(root.rglob("*.bin")):
+        name = card_owner(path.stem, names)
+        if name is not None:
+            digest = blake2b(path.read_bytes(), digest_size=16).digest()
+            found.setdefault(name, {}).setdefault(digest, []).append(path)
+    index = CardIndex()
+    for name, by_digest in found.items():
+        copies = list(by_digest.values())
+        index.cards[name] = copies[0][0]
+        for paths in copies:
+            index.duplicates.extend(paths[1:])
+        if len(copies) > 1:
+            index.conflicts[name] = [paths[0] for paths in copies]
+    return index
+
+
+def pack_cards(index: CardIndex) -> int:
+    """
+    Writes the card archive: cards already in it, or left over from when
+    cards were stored as separate files, plus the newly indexed ones.
+    """
+    cards = {
+        path.stem: path.read_bytes() for path in CARDS_DEST.glob("*.bin")
+    }
+    archive = CardArchive.open()
+    cards.update(archive.items())
+    archive.close()
+    cards.update(
+        (name, path.read_bytes()) for name, path in index.cards.items()
     )
-    critter.price = price
-    critter.time_mask = hour_bitmask
-    critter.month_mask = month_bitmask
-    critter.location = location
-    critter.is_fish = is_fish
-    updated = critter.save()
-    return created, updated
-
-
-def update_critters():
-    created = 0
-    updated = 0
-    for row in fish:
-        c, u = update_critter(row, True)
-        created += c
-        updated += u
-    for row in bugs:
-        c, u = update_critter(row, False)
-        created += c
-        updated += u
-    return created, updated
+    write_cards(cards)
+    return len(cards)
 
 
 if __name__ == "__main__":
-    print("Updating villager table.")
-    created, updated = update_villagers()
-    print(f"Done! {created}/{updated} created.\n")
-    print("Updating critters table.")
-    created, updated = update_critters()
-    print(f"Done! {created}/{updated} created.\n")
+    # The bot opens the game data database as immutable, so it must never
+    # change under it. Update a copy and swap it in; running bots keep
+    # reading the file they opened.
+    new_path = f"{STATIC_DB_PATH}.new"
+    if os.path.exists(STATIC_DB_PATH):
+        shutil.copyfile(STATIC_DB_PATH, new_path)
+    elif os.path.exists(new_path):
+        os.remove(new_path)
+    attach_static(writable=True, path=new_path)
+    with transaction(db):
+        db.create_tables([Villager, Critter])
+        print("Updating villager table.")
+        print(sync(Villager, VILLAGER_FIELDS, villager_rows()), end="\n\n")
+        print("Updating critters table.")
+        print(sync(Critter, CRITTER_FIELDS, critter_rows()), end="\n\n")
+    db.close()
+    os.replace(new_path, STATIC_DB_PATH)
+    print("Packing amiibo cards.")
+    if CARDSPATH.is_dir():
+        cards = index_cards(CARDSPATH, (row[0] for row in villagers))
+    else:
+        cards = CardIndex()
+    for name, paths in cards.conflicts.items():
+        print(f"Conflicting cards for {name}, using {paths[0]}.")
+    print(
+        f"Packed {len(cards.cards)} new cards, "
+        f"skipped {len(cards.duplicates)} duplicates, "
+        f"{pack_cards(cards)} cards in total.\n"
+    )
     print("Done.")